@@ -1,35 +1,182 @@
 # Author: John Boyle
 # Project: Apriori
 
+import os
+import pickle
+import random
 from math import ceil
+from array import array
 from itertools import combinations
+from concurrent.futures import ProcessPoolExecutor
 
 MIN_SUPPORT_PERCENT = 0.035
+# The miner used by main, either 'apriori', 'fp-growth', 'eclat', 'parallel' or 'sampling'
+MINING_MODE = 'apriori'
+# The fraction of transactions an itemset must occur in for Eclat to switch its extensions to diffsets
+DIFFSET_DENSITY = 0.5
+# The number of worker processes of the parallel miner, None to use every core
+WORKER_COUNT = None
+# The frequent itemsets written by main, either 'all', 'closed' or 'maximal'
+OUTPUT_MODE = 'all'
+# The number of transactions, seed and fraction of the minimum support used by the sampling miner
+SAMPLE_SIZE = 1000
+SAMPLE_SEED = None
+SAMPLE_SUPPORT_FACTOR = 0.8
+# The file the frequent itemsets and their supports are kept in between incremental updates
+STATE_FILENAME = 'frequent_itemsets_state.pkl'
 
 # This function reads a file under filename and extracts all transactions and a set of distinct items
 # param filename: The name of the input file (should provide path if necessary)
-# return: A dictionary of transactions and a set of distinct items
-def get_input_data(filename):
-    input_file = open(filename, 'r')
+# param build_index: Whether to also build the vertical tid index of the transactions
+# return: A dictionary of transactions and a set of distinct items (and the tid index if build_index is set)
+def get_input_data(filename, build_index=False):
     transactions = dict()
     # Parses input and picks out the transactions and unique items
     # within those transactions
     itemset = set()
-    for line in input_file:
-        transaction = line.split()
-        transactions[transaction[0]] = transaction[1:]
-        for i in transaction[1:]:
-            if i not in itemset:
-                itemset.add(i)
+    with open(filename, 'r') as input_file:
+        for line in input_file:
+            transaction = line.split()
+            transactions[transaction[0]] = transaction[1:]
+            for i in transaction[1:]:
+                if i not in itemset:
+                    itemset.add(i)
+
+    if build_index:
+        return transactions, itemset, build_tid_index(transactions)
+    return transactions, itemset
+
 
+# Transactions stored in CSR form: the item ids of transaction t are item_ids[offsets[t]:offsets[t + 1]]
+# Item names are interned to dense integer ids and only decoded back to names for output
+# It can be passed to the mining functions in place of the dictionary of transactions
+class EncodedTransactions:
+
+    def __init__(self):
+        self.tids = list()
+        self.offsets = array('q', [0])
+        self.item_ids = array('i')
+        self.item_names = list()
+        self.name_ids = dict()
+
+    def __len__(self):
+        return len(self.tids)
+
+    def keys(self):
+        return iter(self.tids)
+
+    def values(self):
+        for i in range(len(self.tids)):
+            yield self.item_ids[self.offsets[i]:self.offsets[i + 1]]
+
+    # Adds a transaction from its id and raw item names, interning names that have not been seen
+    def add(self, tid, names):
+        ids = set()
+        for i in names:
+            item_id = self.name_ids.get(i)
+            if item_id is None:
+                item_id = len(self.item_names)
+                self.name_ids[i] = item_id
+                self.item_names.append(i)
+            ids.add(item_id)
+        self.tids.append(tid)
+        self.item_ids.extend(sorted(ids))
+        self.offsets.append(len(self.item_ids))
+
+    # Returns the itemset with item ids replaced by their names
+    def decode(self, itemset):
+        return {self.item_names[i].decode() for i in itemset}
+
+
+# This function reads a file under filename in fixed size chunks into integer encoded transactions
+# param filename: The name of the input file (should provide path if necessary)
+# param build_index: Whether to also build the vertical tid index of the transactions
+# param chunk_size: The number of bytes read from the file at a time
+# return: The encoded transactions and a set of distinct item ids (and the tid index if build_index is set)
+def get_encoded_input_data(filename, build_index=False, chunk_size=1 << 20):
+    transactions = EncodedTransactions()
+
+    # Parses every complete line of a chunk and carries a trailing partial line over to the next chunk
+    remainder = b''
+    with open(filename, 'rb') as input_file:
+        while True:
+            chunk = input_file.read(chunk_size)
+            if not chunk:
+                break
+            lines = (remainder + chunk).split(b'\n')
+            remainder = lines.pop()
+            for line in lines:
+                transaction = line.split()
+                if transaction:
+                    transactions.add(transaction[0].decode(), transaction[1:])
+    transaction = remainder.split()
+    if transaction:
+        transactions.add(transaction[0].decode(), transaction[1:])
+
+    itemset = set(range(len(transactions.item_names)))
+    if build_index:
+        return transactions, itemset, build_tid_index(transactions)
     return transactions, itemset
 
 
+# This function returns the itemset with its items decoded to names if the transactions are integer encoded
+# param transactions: The transactions from which the itemset was mined
+# param itemset: The itemset to decode
+# return: The itemset with the item names
+def decode_itemset(transactions, itemset):
+    if isinstance(transactions, EncodedTransactions):
+        return transactions.decode(itemset)
+    return itemset
+
+
+# This function builds a vertical index that maps each item to a bitset of the transactions containing it
+# Bit t of an item's bitset is set if the t-th transaction contains the item
+# param transactions: All transactions in a dictionary
+# return: A dictionary of items to tid bitsets (packed into Python ints)
+def build_tid_index(transactions):
+    bit_arrays = dict()
+    byte_count = (len(transactions) + 7) // 8
+
+    # Sets the bit of the transaction id in the byte array of every item it contains
+    for tid, i in enumerate(transactions.values()):
+        for j in i:
+            if j not in bit_arrays:
+                bit_arrays[j] = bytearray(byte_count)
+            bit_arrays[j][tid >> 3] |= 1 << (tid & 7)
+
+    # Packs the byte arrays so that intersections are a single integer AND
+    tid_index = dict()
+    for i in bit_arrays:
+        tid_index[i] = int.from_bytes(bit_arrays[i], 'little')
+    return tid_index
+
+
+# This function calculates support of the itemset as the popcount of the AND of its items' tid bitsets
+# param tid_index: The vertical tid index of the transactions
+# param itemset: The itemset to calculate support
+# param transaction_count: The number of transactions (the support of the empty itemset)
+# return: The support count of the itemset
+def tid_support(tid_index, itemset, transaction_count):
+    if not itemset:
+        return transaction_count
+
+    tids = -1
+    for i in itemset:
+        if i not in tid_index:
+            return 0
+        tids &= tid_index[i]
+    return tids.bit_count()
+
+
 # This function calculates support of the itemset from transactions
 # param transactions: All transactions in a dictionary
 # param itemset: The itemset to calculate support
+# param tid_index: The vertical tid index of the transactions, used instead of a scan if given
 # return: The support count of the itemset
-def support(transactions, itemset):
+def support(transactions, itemset, tid_index=None):
+    if tid_index is not None:
+        return tid_support(tid_index, itemset, len(transactions))
+
     support_count = 0
 
     # Calculates # of occurrences by iterating throught the list
@@ -41,66 +188,131 @@ def support(transactions, itemset):
     return support_count
 
 
+# This function builds a prefix trie over candidate itemsets of the same size with their items in sorted order
+# param candidate_itemsets: The candidate itemsets as sorted tuples
+# return: The trie as nested dictionaries whose last level maps to the candidate itemsets
+def build_candidate_trie(candidate_itemsets):
+    trie = dict()
+    for i in candidate_itemsets:
+        node = trie
+        for j in i[:-1]:
+            node = node.setdefault(j, dict())
+        node[i[-1]] = i
+    return trie
+
+
+# This function increments the count of every candidate itemset in the trie contained in a sorted transaction
+# param node: The current node of the candidate trie
+# param items: The sorted items of the transaction
+# param start: The position in items to continue the search from
+# param remaining: The number of items still needed to reach a candidate
+# param support_counts: The dictionary of support counts of the candidate itemsets
+# return: void
+def count_trie_subsets(node, items, start, remaining, support_counts):
+    for i in range(start, len(items) - remaining + 1):
+        child = node.get(items[i])
+        if child is None:
+            continue
+        if remaining == 1:
+            support_counts[child] += 1
+        else:
+            count_trie_subsets(child, items, i + 1, remaining - 1, support_counts)
+
+
+# This function counts the support of all candidate itemsets of a level with a single scan over the transactions
+# param transactions: All transactions in a dictionary
+# param candidate_itemsets: The candidate itemsets as sorted tuples of the same size
+# return: A dictionary of support counts of the candidate itemsets
+def count_candidate_supports(transactions, candidate_itemsets):
+    support_counts = dict.fromkeys(candidate_itemsets, 0)
+    if not support_counts:
+        return support_counts
+
+    itemset_size = len(candidate_itemsets[0])
+    trie = build_candidate_trie(candidate_itemsets)
+    candidate_items = {j for i in candidate_itemsets for j in i}
+
+    # Streams each transaction through the trie once, dropping items that appear in no candidate
+    for i in transactions.values():
+        items = sorted(candidate_items.intersection(i))
+        if len(items) >= itemset_size:
+            count_trie_subsets(trie, items, 0, itemset_size, support_counts)
+
+    return support_counts
+
+
+# This function counts the support of candidate itemsets of any size with a single scan over the transactions
+# param transactions: All transactions in a dictionary
+# param candidate_itemsets: The candidate itemsets as sorted tuples
+# return: A dictionary of support counts of the candidate itemsets
+def count_all_candidate_supports(transactions, candidate_itemsets):
+    support_counts = dict.fromkeys(candidate_itemsets, 0)
+
+    # Builds one trie per candidate size and streams each transaction through all of them
+    candidates_by_size = dict()
+    for i in support_counts:
+        candidates_by_size.setdefault(len(i), list()).append(i)
+    tries = [(i, build_candidate_trie(candidates_by_size[i])) for i in candidates_by_size]
+    candidate_items = {j for i in support_counts for j in i}
+
+    for i in transactions.values():
+        items = sorted(candidate_items.intersection(i))
+        for itemset_size, trie in tries:
+            if len(items) >= itemset_size:
+                count_trie_subsets(trie, items, 0, itemset_size, support_counts)
+
+    return support_counts
+
+
 # This function generates a combination from the frequent itemsets of size (itemset_size - 1) and accepts joined itemsets if they share (itemset_size - 2) items
+# Itemsets are joined as sorted tuples, so only itemsets sharing their first (itemset_size - 2) items are paired
+# and every joined itemset is produced exactly once in lexicographic order
 # param frequent_itemsets: The table of frequent itemsets discovered
 # param itemset_size: The size of joined itemsets
-# return: All valid joined itemsets
+# return: All valid joined itemsets as sorted tuples
 def generate_selectively_joined_itemsets(frequent_itemsets, itemset_size):
     joined_itemsets = list()
-
-    # Case if itemset size is two so every combination
-    # of two items is valid
-    if itemset_size == 2:
-        i = 0
-        while i < len(frequent_itemsets[1]) - 1:
-            j = i + 1
-            while j < len(frequent_itemsets[1]):
-                joined_itemsets.append(frequent_itemsets[1][i].union(frequent_itemsets[1][j]))
-                j += 1
-            i += 1
-
-    # Case if itemset size is greater than two and itemsets must be checked
-    # to have common elements before they can be unioned and added to the candidates
-    else:
-        i = 0
-        while i < len(frequent_itemsets[itemset_size - 1]) - 1:
-            j = i + 1
-            while j < len(frequent_itemsets[itemset_size - 1]):
-                if len(frequent_itemsets[itemset_size - 1][i].union(frequent_itemsets[itemset_size - 1][j])) == itemset_size:
-                    if frequent_itemsets[itemset_size - 1][i].union(frequent_itemsets[itemset_size - 1][j]) not in joined_itemsets:
-                        joined_itemsets.append(frequent_itemsets[itemset_size - 1][i].union(frequent_itemsets[itemset_size - 1][j]))
-                j += 1
-            i += 1
+    previous_itemsets = sorted(tuple(sorted(i)) for i in frequent_itemsets[itemset_size - 1])
+
+    # Sorted itemsets with a common prefix are adjacent, so each run of them is
+    # joined pairwise on their last items
+    start = 0
+    while start < len(previous_itemsets):
+        prefix = previous_itemsets[start][:-1]
+        end = start + 1
+        while end < len(previous_itemsets) and previous_itemsets[end][:-1] == prefix:
+            end += 1
+        for i in range(start, end - 1):
+            for j in range(i + 1, end):
+                joined_itemsets.append(previous_itemsets[i] + previous_itemsets[j][-1:])
+        start = end
 
     return joined_itemsets
 
 
 # This function checks all the subsets of selected itemsets whether they all are frequent or not and prunes the itemset if anyone of the subsets is not frequent
-# param selected_itemsets: The itemsets which are needed to be checked
+# param joined_itemsets: The sorted tuple itemsets which are needed to be checked
 # param frequent_itemsets: The table of frequent itemsets discovered
 # param itemset_size: The size of intended frequent itemsets
 # return: The itemsets whose all subsets are frequent
 def apply_apriori_pruning(joined_itemsets, frequent_itemsets, itemset_size):
+    previous_itemsets = {tuple(sorted(i)) for i in frequent_itemsets[itemset_size - 1]}
+    candidate_itemsets = list()
 
-    # Generates all combinations of size - 1 itemsets for each itemset and prunes
-    # if any of those itemsets are not frequent
+    # Drops one item at a time from each itemset and prunes it if that subset is not
+    # frequent. The subsets without either of the last two items are the joined
+    # itemsets themselves so they are skipped
     for i in joined_itemsets:
-        subSets = list(combinations(list(i), itemset_size - 1))
-        j = 0
-        while j < len(subSets):
-            if set(subSets[j]) in frequent_itemsets[itemset_size - 1]:
-                j += 1
-            else:
-                j = len(subSets)
-                joined_itemsets.remove(i)
+        if all(i[:j] + i[j + 1:] in previous_itemsets for j in range(itemset_size - 2)):
+            candidate_itemsets.append(i)
 
-    return joined_itemsets
+    return candidate_itemsets
 
 
 # This function generates candidate itemsets of size (itemset_size) by selective joining and apriori pruning
 # param frequent_itemsets: The table of frequent itemsets discovered
 # param itemset_size: The size of intended frequent itemsets
-# return: candidate itemsets formed by selective joining and apriori pruning
+# return: candidate itemsets formed by selective joining and apriori pruning as sorted tuples
 def generate_candidate_itemsets(frequent_itemsets, itemset_size):
     joined_itemsets = generate_selectively_joined_itemsets(frequent_itemsets, itemset_size)
     candidate_itemsets = apply_apriori_pruning(joined_itemsets, frequent_itemsets, itemset_size)
@@ -111,8 +323,10 @@ def generate_candidate_itemsets(frequent_itemsets, itemset_size):
 # param transactions: The transactions based upon which support is calculated
 # param items: The unique set of items present in the transaction
 # param min_support: The minimum support to find frequent itemsets
+# param tid_index: The vertical tid index of the transactions, used instead of scans if given
+# param support_table: A dictionary which is filled with the support count of every frequent itemset if given
 # return: The table of all frequent itemsets of different sizes
-def generate_all_frequent_itemsets(transactions, items, min_support):
+def generate_all_frequent_itemsets(transactions, items, min_support, tid_index=None, support_table=None):
     frequent_itemsets = dict()
     itemset_size = 0
     frequent_itemsets[itemset_size] = list()
@@ -122,9 +336,17 @@ def generate_all_frequent_itemsets(transactions, items, min_support):
     itemset_size += 1
     frequent_itemsets[itemset_size] = list()
 
-    for i in items:
-        if support(transactions, {i}) >= min_support:
+    if tid_index is None:
+        support_counts = count_candidate_supports(transactions, [(i,) for i in items])
+    for i in sorted(items):
+        if tid_index is None:
+            support_count = support_counts[(i,)]
+        else:
+            support_count = support(transactions, {i}, tid_index)
+        if support_count >= min_support:
             frequent_itemsets[itemset_size].append({i})
+            if support_table is not None:
+                support_table[frozenset((i,))] = support_count
 
     # frequent itemsets of greater size
     itemset_size += 1
@@ -134,33 +356,591 @@ def generate_all_frequent_itemsets(transactions, items, min_support):
         candidate_itemsets = generate_candidate_itemsets(frequent_itemsets, itemset_size)
         pruned_itemset = list()
 
+        # Without a tid index all candidates of the level are counted in one scan
+        if tid_index is None:
+            support_counts = count_candidate_supports(transactions, candidate_itemsets)
+
         # If the support for a candidate itemset is greater than the minimum support,
         # it is a frequent itemset so it is added to the list
         for i in candidate_itemsets:
-            if support(transactions, i) >= min_support:
-                pruned_itemset.append(i)
+            if tid_index is None:
+                support_count = support_counts[i]
+            else:
+                support_count = support(transactions, i, tid_index)
+            if support_count >= min_support:
+                pruned_itemset.append(set(i))
+                if support_table is not None:
+                    support_table[frozenset(i)] = support_count
 
         frequent_itemsets[itemset_size] = pruned_itemset
         itemset_size += 1
     return frequent_itemsets
 
 
+# This function fills in an empty list for every itemset size up to one past the largest frequent itemset,
+# so that tables built by the other miners have the same keys as the level-wise search
+# param frequent_itemsets: The table of frequent itemsets discovered
+# return: The table of frequent itemsets with every size present
+def fill_itemset_sizes(frequent_itemsets):
+    largest_size = max(i for i in frequent_itemsets if frequent_itemsets[i])
+    for i in range(1, largest_size + 2):
+        if i not in frequent_itemsets:
+            frequent_itemsets[i] = list()
+    return frequent_itemsets
+
+
+# A node of an FP-tree which holds an item, the count of transactions sharing the path to it
+# and a link to the next node in the tree holding the same item
+class FPNode:
+    __slots__ = ('item', 'count', 'parent', 'children', 'link')
+
+    def __init__(self, item, parent):
+        self.item = item
+        self.count = 0
+        self.parent = parent
+        self.children = dict()
+        self.link = None
+
+
+# This function builds an FP-tree from weighted paths with one pass to count items and one pass to insert paths
+# param paths: A list of (items, count) pairs, the transactions or a conditional pattern base
+# param min_support: The minimum support for an item to be kept in the tree
+# return: The header table mapping each frequent item to its first node, and the support of each frequent item
+def build_fp_tree(paths, min_support):
+    item_counts = dict()
+    for path, count in paths:
+        for i in set(path):
+            item_counts[i] = item_counts.get(i, 0) + count
+
+    frequent_items = dict()
+    for i in item_counts:
+        if item_counts[i] >= min_support:
+            frequent_items[i] = item_counts[i]
+
+    # Inserts the frequent items of each path in descending order of support so
+    # that paths share as long a prefix as possible
+    root = FPNode(None, None)
+    header = dict()
+    for path, count in paths:
+        node = root
+        for i in sorted({j for j in path if j in frequent_items}, key=lambda j: (-frequent_items[j], j)):
+            child = node.children.get(i)
+            if child is None:
+                child = FPNode(i, node)
+                node.children[i] = child
+                child.link = header.get(i)
+                header[i] = child
+            child.count += count
+            node = child
+
+    return header, frequent_items
+
+
+# This function mines all frequent itemsets of an FP-tree by recursively building conditional FP-trees
+# param header: The header table of the FP-tree
+# param frequent_items: The support of each item in the FP-tree
+# param suffix: The itemset on which the FP-tree is conditioned
+# param min_support: The minimum support to find frequent itemsets
+# param frequent_itemsets: The table of frequent itemsets which found itemsets are added to
+# param support_table: A dictionary which is filled with the support count of every frequent itemset if given
+# return: void
+def mine_fp_tree(header, frequent_items, suffix, min_support, frequent_itemsets, support_table=None):
+
+    # Grows the suffix by each item starting from the least frequent one
+    for i in sorted(frequent_items, key=lambda j: (frequent_items[j], j)):
+        itemset = suffix | {i}
+        if len(itemset) not in frequent_itemsets:
+            frequent_itemsets[len(itemset)] = list()
+        frequent_itemsets[len(itemset)].append(itemset)
+        if support_table is not None:
+            support_table[frozenset(itemset)] = frequent_items[i]
+
+        # Collects the prefix paths of every node holding the item as the conditional pattern base
+        conditional_paths = list()
+        node = header[i]
+        while node is not None:
+            path = list()
+            parent = node.parent
+            while parent.item is not None:
+                path.append(parent.item)
+                parent = parent.parent
+            if path:
+                conditional_paths.append((path, node.count))
+            node = node.link
+
+        conditional_header, conditional_items = build_fp_tree(conditional_paths, min_support)
+        if conditional_items:
+            mine_fp_tree(conditional_header, conditional_items, itemset, min_support, frequent_itemsets, support_table)
+
+
+# This function generates the same table of frequent itemsets as generate_all_frequent_itemsets with FP-growth,
+# which makes two passes over the transactions and does not generate candidate itemsets
+# param transactions: The transactions based upon which support is calculated
+# param items: The unique set of items present in the transaction
+# param min_support: The minimum support to find frequent itemsets
+# param support_table: A dictionary which is filled with the support count of every frequent itemset if given
+# return: The table of all frequent itemsets of different sizes
+def generate_all_frequent_itemsets_fp_growth(transactions, items, min_support, support_table=None):
+    frequent_itemsets = dict()
+    frequent_itemsets[0] = list()
+    frequent_itemsets[0].append(frozenset())
+
+    paths = [(i, 1) for i in transactions.values()]
+    header, frequent_items = build_fp_tree(paths, min_support)
+    mine_fp_tree(header, frequent_items, set(), min_support, frequent_itemsets, support_table)
+
+    # Orders each size of itemsets as the level-wise miner finds them instead of in mining order
+    for i in frequent_itemsets:
+        frequent_itemsets[i].sort(key=lambda l: sorted(l))
+    return fill_itemset_sizes(frequent_itemsets)
+
+
+# This function extends the itemsets of one Eclat equivalence class depth first and records the frequent ones
+# Members hold tidsets, or once the class prefix is dense, diffsets: the transactions of the prefix that do not hold
+# the member, so the support of an extension is the support of its parent minus the size of its diffset
+# param prefix: The itemset shared by the class as a tuple
+# param members: A list of (item, tidset or diffset, support) triples of the class
+# param min_support: The minimum support to find frequent itemsets
+# param diffset_support: The support above which the extensions of an itemset use diffsets
+# param use_diffsets: Whether the members hold diffsets instead of tidsets
+# param frequent_itemsets: A dictionary which is filled with the frequent itemsets found and their support
+# return: void
+def eclat_extend(prefix, members, min_support, diffset_support, use_diffsets, frequent_itemsets):
+    for i in range(len(members)):
+        item, tids, support_count = members[i]
+        itemset = prefix + (item,)
+        frequent_itemsets[frozenset(itemset)] = support_count
+        child_diffsets = use_diffsets or support_count >= diffset_support
+
+        children = list()
+        for other_item, other_tids, _ in members[i + 1:]:
+            if use_diffsets:
+                child_tids = other_tids & ~tids
+                child_support = support_count - child_tids.bit_count()
+            elif child_diffsets:
+                child_tids = tids & ~other_tids
+                child_support = support_count - child_tids.bit_count()
+            else:
+                child_tids = tids & other_tids
+                child_support = child_tids.bit_count()
+            if child_support >= min_support:
+                children.append((other_item, child_tids, child_support))
+
+        if children:
+            eclat_extend(itemset, children, min_support, diffset_support, child_diffsets, frequent_itemsets)
+
+
+# This function generates the same table of frequent itemsets as generate_all_frequent_itemsets with a depth first
+# Eclat search over the tid bitsets of the items, switching to diffsets on dense classes (dEclat), so only the
+# classes along the current search path are held in memory
+# param transactions: The transactions based upon which support is calculated
+# param items: The unique set of items present in the transaction
+# param min_support: The minimum support to find frequent itemsets
+# param tid_index: The vertical tid index of the transactions, built if not given
+# param support_table: A dictionary which is filled with the support count of every frequent itemset if given
+# return: The table of all frequent itemsets of different sizes
+def generate_all_frequent_itemsets_eclat(transactions, items, min_support, tid_index=None, support_table=None):
+    if tid_index is None:
+        tid_index = build_tid_index(transactions)
+
+    members = list()
+    for i in sorted(items):
+        support_count = tid_support(tid_index, {i}, len(transactions))
+        if support_count >= min_support:
+            members.append((i, tid_index[i], support_count))
+    members.sort(key=lambda l: l[2])
+
+    found_itemsets = dict()
+    eclat_extend((), members, min_support, DIFFSET_DENSITY * len(transactions), False, found_itemsets)
+
+    frequent_itemsets = dict()
+    frequent_itemsets[0] = list()
+    frequent_itemsets[0].append(frozenset())
+    for i in sorted(tuple(sorted(j)) for j in found_itemsets):
+        frequent_itemsets.setdefault(len(i), list()).append(set(i))
+    if support_table is not None:
+        support_table.update(found_itemsets)
+    return fill_itemset_sizes(frequent_itemsets)
+
+
+# This function mines the itemsets that are frequent within one partition of the transactions
+# param partition: A dictionary of the transactions of the partition
+# param min_support: The minimum support scaled to the size of the partition
+# return: The locally frequent itemsets as sorted tuples
+def mine_partition(partition, min_support):
+    items = {j for i in partition.values() for j in i}
+    frequent_itemsets = generate_all_frequent_itemsets(partition, items, min_support)
+    return [tuple(sorted(j)) for i in frequent_itemsets if i > 0 for j in frequent_itemsets[i]]
+
+
+# This function generates the same table of frequent itemsets as generate_all_frequent_itemsets on a process pool
+# The transactions are split into one partition per worker and every itemset frequent in the whole data is frequent in
+# at least one partition at a proportionally scaled minimum support, so the union of the locally frequent itemsets
+# is counted exactly over all partitions in a second parallel pass
+# param transactions: The transactions based upon which support is calculated
+# param items: The unique set of items present in the transaction
+# param min_support: The minimum support to find frequent itemsets
+# param workers: The number of worker processes, None to use every core
+# param support_table: A dictionary which is filled with the support count of every frequent itemset if given
+# return: The table of all frequent itemsets of different sizes
+def generate_all_frequent_itemsets_parallel(transactions, items, min_support, workers=None, support_table=None):
+    worker_count = workers or os.cpu_count() or 1
+    with ProcessPoolExecutor(worker_count) as executor:
+
+        # Splits the transactions into contiguous partitions of nearly equal size
+        transaction_list = [list(i) for i in transactions.values()]
+        partition_size = max(1, ceil(len(transaction_list) / worker_count))
+        partitions = list()
+        for i in range(0, len(transaction_list), partition_size):
+            partitions.append(dict(enumerate(transaction_list[i:i + partition_size])))
+
+        # Phase one mines each partition at its share of the minimum support
+        local_min_supports = [ceil(min_support * len(i) / len(transaction_list)) for i in partitions]
+        candidate_itemsets = set()
+        for i in executor.map(mine_partition, partitions, local_min_supports):
+            candidate_itemsets.update(i)
+        candidate_itemsets = sorted(candidate_itemsets)
+
+        # Phase two counts every candidate in every partition for its exact global support
+        support_counts = dict.fromkeys(candidate_itemsets, 0)
+        for i in executor.map(count_all_candidate_supports, partitions, [candidate_itemsets] * len(partitions)):
+            for j in i:
+                support_counts[j] += i[j]
+
+    frequent_itemsets = dict()
+    frequent_itemsets[0] = list()
+    frequent_itemsets[0].append(frozenset())
+    for i in candidate_itemsets:
+        if support_counts[i] >= min_support:
+            frequent_itemsets.setdefault(len(i), list()).append(set(i))
+            if support_table is not None:
+                support_table[frozenset(i)] = support_counts[i]
+
+    return fill_itemset_sizes(frequent_itemsets)
+
+
+# This function extends the itemsets of one CHARM equivalence class and records the closed itemsets found
+# Items with the same tidset are merged into the itemset and items whose tidset contains it are absorbed,
+# so itemsets that cannot be closed are never generated
+# param nodes: A list of [itemset, tidset] pairs of the class in ascending order of support
+# param min_support: The minimum support to find frequent itemsets
+# param closed_itemsets: A dictionary of tidsets to the closed itemset holding them
+# return: void
+def charm_extend(nodes, min_support, closed_itemsets):
+    for i in range(len(nodes)):
+        if nodes[i] is None:
+            continue
+        itemset, tids = nodes[i]
+        children = list()
+
+        for j in range(i + 1, len(nodes)):
+            if nodes[j] is None:
+                continue
+            other_itemset, other_tids = nodes[j]
+            joined_tids = tids & other_tids
+            if joined_tids.bit_count() < min_support:
+                continue
+
+            if tids == other_tids:
+                nodes[j] = None
+                itemset = itemset | other_itemset
+            elif joined_tids == tids:
+                itemset = itemset | other_itemset
+            elif joined_tids == other_tids:
+                nodes[j] = None
+                children.append([itemset | other_itemset, joined_tids])
+            else:
+                children.append([itemset | other_itemset, joined_tids])
+
+        # Items merged into the itemset after a child was made also belong to the child
+        if children:
+            for child in children:
+                child[0] = child[0] | itemset
+            children.sort(key=lambda l: l[1].bit_count())
+            charm_extend(children, min_support, closed_itemsets)
+
+        # Every itemset with the same tidset is contained in the closed itemset of that tidset
+        closed_itemsets[tids] = closed_itemsets.get(tids, frozenset()) | itemset
+
+
+# This function generates the table of closed frequent itemsets, the frequent itemsets without a superset of
+# equal support, with CHARM over the tid bitsets of the items
+# param transactions: The transactions based upon which support is calculated
+# param items: The unique set of items present in the transaction
+# param min_support: The minimum support to find frequent itemsets
+# param tid_index: The vertical tid index of the transactions, built if not given
+# param support_table: A dictionary which is filled with the support count of every closed itemset if given
+# return: The table of closed frequent itemsets of different sizes
+def generate_closed_frequent_itemsets(transactions, items, min_support, tid_index=None, support_table=None):
+    if tid_index is None:
+        tid_index = build_tid_index(transactions)
+
+    nodes = list()
+    for i in sorted(items):
+        if tid_support(tid_index, {i}, len(transactions)) >= min_support:
+            nodes.append([frozenset((i,)), tid_index[i]])
+    nodes.sort(key=lambda l: l[1].bit_count())
+
+    closed_itemsets = dict()
+    charm_extend(nodes, min_support, closed_itemsets)
+
+    frequent_itemsets = dict()
+    frequent_itemsets[0] = list()
+    frequent_itemsets[0].append(frozenset())
+    for i in sorted(closed_itemsets.values(), key=lambda l: sorted(l)):
+        frequent_itemsets.setdefault(len(i), list()).append(set(i))
+    if support_table is not None:
+        for i in closed_itemsets:
+            support_table[closed_itemsets[i]] = i.bit_count()
+    return fill_itemset_sizes(frequent_itemsets)
+
+
+# This function searches the extensions of an itemset depth first and records the maximal itemsets found
+# A branch is skipped if the itemset with all of its possible extensions is contained in a maximal itemset already
+# found, and extensions occurring in every transaction of the itemset are added to it without branching
+# Only the maximal itemsets containing the current itemset can contain its extensions, so each branch checks a local
+# list of those instead of every maximal itemset found (progressive focusing). An itemset found later in the search
+# never contains one found earlier, as the earlier one holds an item which comes before the later branch
+# param itemset: The current frequent itemset
+# param tail: A list of (item, tidset of the itemset with the item) pairs of the possible extensions
+# param min_support: The minimum support to find frequent itemsets
+# param maximal_itemsets: A dictionary of the maximal itemsets found to their tidsets
+# param local_maximal_itemsets: A list of the maximal itemsets found which contain the itemset
+# return: A list of the maximal itemsets found by this search
+def maximal_extend(itemset, tail, min_support, maximal_itemsets, local_maximal_itemsets):
+    found_itemsets = list()
+    extensions = itemset.union(i for i, _ in tail)
+    if any(extensions <= j for j in local_maximal_itemsets):
+        return found_itemsets
+
+    for i in range(len(tail)):
+        item, tids = tail[i]
+        extended_itemset = itemset | {item}
+        extended_tail = list()
+        for other_item, other_tids in tail[i + 1:]:
+            joined_tids = tids & other_tids
+            if joined_tids == tids:
+                extended_itemset = extended_itemset | {other_item}
+            elif joined_tids.bit_count() >= min_support:
+                extended_tail.append((other_item, joined_tids))
+
+        extended_local_itemsets = [j for j in local_maximal_itemsets if extended_itemset <= j]
+        if extended_tail:
+            extended_tail.sort(key=lambda l: l[1].bit_count())
+            new_itemsets = maximal_extend(extended_itemset, extended_tail, min_support, maximal_itemsets,
+                                          extended_local_itemsets)
+        elif not extended_local_itemsets:
+            maximal_itemsets[extended_itemset] = tids
+            new_itemsets = [extended_itemset]
+        else:
+            new_itemsets = list()
+        local_maximal_itemsets.extend(new_itemsets)
+        found_itemsets.extend(new_itemsets)
+    return found_itemsets
+
+
+# This function generates the table of maximal frequent itemsets, the frequent itemsets without a frequent superset,
+# with a GenMax style depth first search over the tid bitsets of the items
+# param transactions: The transactions based upon which support is calculated
+# param items: The unique set of items present in the transaction
+# param min_support: The minimum support to find frequent itemsets
+# param tid_index: The vertical tid index of the transactions, built if not given
+# param support_table: A dictionary which is filled with the support count of every maximal itemset if given
+# return: The table of maximal frequent itemsets of different sizes
+def generate_maximal_frequent_itemsets(transactions, items, min_support, tid_index=None, support_table=None):
+    if tid_index is None:
+        tid_index = build_tid_index(transactions)
+
+    tail = list()
+    for i in sorted(items):
+        if tid_support(tid_index, {i}, len(transactions)) >= min_support:
+            tail.append((i, tid_index[i]))
+    tail.sort(key=lambda l: l[1].bit_count())
+
+    maximal_itemsets = dict()
+    maximal_extend(frozenset(), tail, min_support, maximal_itemsets, list())
+
+    frequent_itemsets = dict()
+    frequent_itemsets[0] = list()
+    frequent_itemsets[0].append(frozenset())
+    for i in sorted(maximal_itemsets, key=lambda l: sorted(l)):
+        frequent_itemsets.setdefault(len(i), list()).append(set(i))
+        if support_table is not None:
+            support_table[i] = maximal_itemsets[i].bit_count()
+    return fill_itemset_sizes(frequent_itemsets)
+
+
+# This function mines the frequent itemsets of a random sample of the transactions at a lowered minimum support and
+# verifies them in one scan over all transactions together with their negative border, the itemsets which are not
+# frequent in the sample but all of whose subsets are. If no itemset of the negative border is frequent, every
+# frequent itemset was found (Toivonen)
+# param transactions: The transactions based upon which support is calculated
+# param items: The unique set of items present in the transaction
+# param min_support: The minimum support to find frequent itemsets
+# param sample_size: The number of transactions in the sample
+# param seed: The seed of the random sample
+# param support_factor: The fraction of the scaled minimum support used to mine the sample
+# param support_table: A dictionary which is filled with the support count of every frequent itemset found if given
+# return: The table of frequent itemsets found and whether it is provably complete
+def generate_frequent_itemsets_by_sampling(transactions, items, min_support, sample_size, seed=None,
+                                           support_factor=SAMPLE_SUPPORT_FACTOR, support_table=None):
+    tids = list(transactions.keys())
+    values = list(transactions.values())
+    sample_indices = random.Random(seed).sample(range(len(tids)), min(sample_size, len(tids)))
+    sample = {tids[i]: values[i] for i in sample_indices}
+    sample_min_support = max(1, ceil(support_factor * min_support * len(sample) / len(tids)))
+    sample_itemsets = generate_all_frequent_itemsets(sample, items, sample_min_support)
+
+    # Collects the itemsets frequent in the sample and the negative border from each level's candidates
+    candidate_itemsets = [(i,) for i in sorted(items)]
+    for itemset_size in range(2, len(sample_itemsets)):
+        candidate_itemsets.extend(generate_candidate_itemsets(sample_itemsets, itemset_size))
+    sample_frequent = {frozenset(j) for i in sample_itemsets for j in sample_itemsets[i]}
+
+    support_counts = count_all_candidate_supports(transactions, candidate_itemsets)
+
+    complete = True
+    frequent_itemsets = dict()
+    frequent_itemsets[0] = list()
+    frequent_itemsets[0].append(frozenset())
+    for i in candidate_itemsets:
+        if support_counts[i] >= min_support:
+            if frozenset(i) not in sample_frequent:
+                complete = False
+            frequent_itemsets.setdefault(len(i), list()).append(set(i))
+            if support_table is not None:
+                support_table[frozenset(i)] = support_counts[i]
+
+    return fill_itemset_sizes(frequent_itemsets), complete
+
+
+# This function creates the state kept between incremental updates from the supports of all frequent itemsets
+# param support_table: The support counts of all frequent itemsets
+# param transaction_count: The number of transactions the itemsets were mined from
+# param min_support_percent: The minimum support percentage the itemsets were mined with
+# return: The state dictionary
+def get_mining_state(support_table, transaction_count, min_support_percent):
+    return {'transaction_count': transaction_count, 'min_support_percent': min_support_percent,
+            'support_table': dict(support_table)}
+
+
+# This function writes the state kept between incremental updates to a file
+# param filename: The name of the state file
+# param state: The state dictionary
+# return: void
+def save_mining_state(filename, state):
+    with open(filename, 'wb') as file:
+        pickle.dump(state, file)
+
+
+# This function reads the state kept between incremental updates from a file
+# param filename: The name of the state file
+# return: The state dictionary
+def load_mining_state(filename):
+    with open(filename, 'rb') as file:
+        return pickle.load(file)
+
+
+# This function updates the frequent itemsets of previously mined transactions with a batch of new transactions (FUP)
+# Itemsets that were frequent have their stored support added to their count in the new batch. An itemset that was
+# not frequent had a support below the old minimum support, so it is only counted in the old transactions if its
+# count in the new batch can make up the difference, so the old transactions are only loaded if such an itemset exists
+# param state: The state of the previous run, from get_mining_state
+# param load_old_transactions: A function which returns the transactions of the previous run
+# param new_transactions: The batch of new transactions
+# param support_table: A dictionary which is filled with the support count of every frequent itemset if given
+# return: The table of all frequent itemsets of the combined transactions and the updated state
+def update_frequent_itemsets(state, load_old_transactions, new_transactions, support_table=None):
+    old_support_table = state['support_table']
+    old_count = state['transaction_count']
+    min_support_percent = state['min_support_percent']
+    transaction_count = old_count + len(new_transactions)
+    min_support = ceil(min_support_percent * transaction_count)
+    old_min_support = ceil(min_support_percent * old_count)
+    min_new_support = min_support - max(old_min_support - 1, 0)
+    if support_table is None:
+        support_table = dict()
+
+    old_transactions = None
+    frequent_itemsets = dict()
+    frequent_itemsets[0] = list()
+    frequent_itemsets[0].append(frozenset())
+    items = {j for i in new_transactions.values() for j in i}
+    items.update(j for i in old_support_table if len(i) == 1 for j in i)
+    candidate_itemsets = [(i,) for i in sorted(items)]
+    itemset_size = 1
+
+    while candidate_itemsets:
+        new_counts = count_candidate_supports(new_transactions, candidate_itemsets)
+
+        # Only itemsets which were not frequent before but are frequent enough in the new batch
+        # are counted in the old transactions
+        rescanned_itemsets = list()
+        for i in candidate_itemsets:
+            if frozenset(i) not in old_support_table and new_counts[i] >= min_new_support:
+                rescanned_itemsets.append(i)
+        old_counts = dict()
+        if rescanned_itemsets:
+            if old_transactions is None:
+                old_transactions = load_old_transactions()
+            old_counts = count_candidate_supports(old_transactions, rescanned_itemsets)
+
+        frequent_itemsets[itemset_size] = list()
+        for i in candidate_itemsets:
+            support_count = new_counts[i] + old_support_table.get(frozenset(i), old_counts.get(i, 0))
+            if support_count >= min_support:
+                frequent_itemsets[itemset_size].append(set(i))
+                support_table[frozenset(i)] = support_count
+
+        itemset_size += 1
+        candidate_itemsets = generate_candidate_itemsets(frequent_itemsets, itemset_size)
+
+    frequent_itemsets = fill_itemset_sizes(frequent_itemsets)
+    return frequent_itemsets, get_mining_state(support_table, transaction_count, min_support_percent)
+
+
+# This function pairs each frequent itemset of size greater than one with its support percentage
+# param frequent_itemsets_table: The dictionary which contains all frequent itemsets
+# param transactions: The transactions from which the frequent itemsets are found
+# param tid_index: The vertical tid index of the transactions, used instead of scans if given
+# param support_table: The support counts recorded by the miner, used instead of recounting if given
+# param transaction_count: The number of transactions the supports are a percentage of, if not all of transactions
+# return: A list of (itemset, support percentage) pairs
+def get_result_table(frequent_itemsets_table, transactions, tid_index=None, support_table=None,
+                     transaction_count=None):
+    if transaction_count is None:
+        transaction_count = len(transactions)
+    result_table = list()
+    for i in frequent_itemsets_table:
+        if i > 1:
+            for j in frequent_itemsets_table[i]:
+                if support_table is not None:
+                    support_count = support_table[frozenset(j)]
+                else:
+                    support_count = support(transactions, j, tid_index)
+                result_table.append((decode_itemset(transactions, j), support_count / transaction_count * 100))
+    return result_table
+
+
 # This function writes all frequent itemsets along with their support to the output file with the given filename
 # param filename: The name for the output file
 # param frequent_itemsets_table: The dictionary which contains all frequent itemsets
 # param transactions: The transactions from which the frequent itemsets are found
+# param tid_index: The vertical tid index of the transactions, used instead of scans if given
+# param support_table: The support counts recorded by the miner, used instead of recounting if given
+# param transaction_count: The number of transactions the supports are a percentage of, if not all of transactions
 # return: void
-def output_to_file(filename, frequent_itemsets_table, transactions):
+def output_to_file(filename, frequent_itemsets_table, transactions, tid_index=None, support_table=None,
+                   transaction_count=None):
     file = open(filename, 'w')
 
     # Prints all frequent itemsets  for each size itemset and formats output to
     # match the required specifications
-    for i in frequent_itemsets_table:
-        if i > 1:
-            for j in frequent_itemsets_table[i]:
-                data = str(j)
-                data = data.replace("'","")
-                file.write(data + " " + "%.2f" % (support(transactions, j)/len(transactions)*100) + "% support\n")
+    for itemset, support_percent in get_result_table(frequent_itemsets_table, transactions, tid_index, support_table,
+                                                     transaction_count):
+        data = str(itemset)
+        data = data.replace("'","")
+        file.write(data + " " + "%.2f" % support_percent + "% support\n")
 
     file.close()
 
@@ -169,10 +949,60 @@ def output_to_file(filename, frequent_itemsets_table, transactions):
 def main():
     input_filename = 'assignment1_input.txt'
     output_filename = 'result.txt'
-    cellular_functions, genes_set = get_input_data(input_filename)
+    cellular_functions, genes_set, tid_index = get_input_data(input_filename, build_index=True)
     min_support = ceil(MIN_SUPPORT_PERCENT * len(cellular_functions))
-    frequent_itemsets_table = generate_all_frequent_itemsets(cellular_functions, genes_set, min_support)
-    output_to_file(output_filename, frequent_itemsets_table, cellular_functions)
+    support_table = dict()
+    complete = True
+    if OUTPUT_MODE == 'closed':
+        frequent_itemsets_table = generate_closed_frequent_itemsets(cellular_functions, genes_set, min_support, tid_index, support_table)
+    elif OUTPUT_MODE == 'maximal':
+        frequent_itemsets_table = generate_maximal_frequent_itemsets(cellular_functions, genes_set, min_support, tid_index, support_table)
+    elif MINING_MODE == 'fp-growth':
+        frequent_itemsets_table = generate_all_frequent_itemsets_fp_growth(cellular_functions, genes_set, min_support, support_table)
+    elif MINING_MODE == 'eclat':
+        frequent_itemsets_table = generate_all_frequent_itemsets_eclat(cellular_functions, genes_set, min_support, tid_index, support_table)
+    elif MINING_MODE == 'parallel':
+        frequent_itemsets_table = generate_all_frequent_itemsets_parallel(cellular_functions, genes_set, min_support, WORKER_COUNT, support_table)
+    elif MINING_MODE == 'sampling':
+        frequent_itemsets_table, complete = generate_frequent_itemsets_by_sampling(cellular_functions, genes_set, min_support, SAMPLE_SIZE, SAMPLE_SEED, support_table=support_table)
+        if not complete:
+            print("The sample missed part of the negative border, so the result may be incomplete")
+            print("The state for incremental updates is not saved")
+    else:
+        frequent_itemsets_table = generate_all_frequent_itemsets(cellular_functions, genes_set, min_support, tid_index, support_table)
+    output_to_file(output_filename, frequent_itemsets_table, cellular_functions, support_table=support_table)
+    # An incomplete result would make an update treat a missed frequent itemset as infrequent
+    if OUTPUT_MODE == 'all' and complete:
+        save_mining_state(STATE_FILENAME, get_mining_state(support_table, len(cellular_functions), MIN_SUPPORT_PERCENT))
+
+
+# The main function for incremental runs which updates the frequent itemsets saved by a previous run with a new batch
+# The batch is appended to the input file afterwards so that the input file and the saved state stay in step
+# The input file is only read if an itemset has to be counted in the previous transactions
+def update_main():
+    input_filename = 'assignment1_input.txt'
+    batch_filename = 'assignment1_batch.txt'
+    output_filename = 'result.txt'
+    state = load_mining_state(STATE_FILENAME)
+    new_cellular_functions, new_genes_set = get_input_data(batch_filename)
+    support_table = dict()
+    frequent_itemsets_table, state = update_frequent_itemsets(state, lambda: get_input_data(input_filename)[0],
+                                                              new_cellular_functions, support_table)
+    output_to_file(output_filename, frequent_itemsets_table, new_cellular_functions, support_table=support_table,
+                   transaction_count=state['transaction_count'])
+
+    # Appends the batch before saving the state so that a failed append cannot leave the state ahead of the input
+    # file, starting a new line if the input file does not end with one
+    needs_newline = False
+    with open(input_filename, 'rb') as input_file:
+        if input_file.seek(0, 2) > 0:
+            input_file.seek(-1, 2)
+            needs_newline = input_file.read(1) != b'\n'
+    with open(batch_filename, 'r') as batch_file, open(input_filename, 'a') as input_file:
+        if needs_newline:
+            input_file.write('\n')
+        input_file.write(batch_file.read())
+    save_mining_state(STATE_FILENAME, state)
 
 
 if __name__ == '__main__':
@@ -1,15 +1,26 @@
 # Author: John Boyle
 # Project: Association Rule Mining
 
+# Import NumPy to use arrays
+import pickle
+import numpy as np
+
 MIN_SUPPORT = 30
 MIN_CONFIDENCE = .6
 MIN_SIZE = 3
+# The rules written by main, either 'class' for rules predicting the class label or 'general' for every consequent
+RULE_MODE = 'class'
+LABELS = ('BreastCancer', 'ColonCancer')
+# The number of matrix cells gathered at a time when counting a batch of itemsets
+MATRIX_BATCH_CELLS = 1 << 24
 
 
 # This function reads a file under filename and extracts all transactions and a set of distinct items
 # param filename: The name of the input file (should provide path if necessary)
-# return: A list of transactions and a list of distinct items
-def get_input_data(filename):
+# param build_matrix: Whether to also build the boolean matrix encoding of the transactions
+# return: A list of transactions and a list of distinct items (and the boolean matrix and its column index
+# if build_matrix is set)
+def get_input_data(filename, build_matrix=False):
     input_file = open(filename, 'r')
     transactions = list()
     itemset = list()
@@ -27,16 +38,75 @@ def get_input_data(filename):
         itemset.append({'gene' + str(i) + ' UP', 'ColonCancer'})
         itemset.append({'gene' + str(i) + ' UP', 'BreastCancer'})
 
+    if build_matrix:
+        matrix, column_index = get_boolean_matrix(transactions)
+        return transactions, itemset, matrix, column_index
     return transactions, itemset
 
 
+# This function encodes the transactions as a boolean matrix with a row per transaction and a column per
+# gene state and class label
+# param transactions: The list of transactions
+# return: The boolean matrix and a dictionary of items to their columns
+def get_boolean_matrix(transactions):
+    column_index = dict()
+    for i, item in enumerate(sorted(set().union(*transactions))):
+        column_index[item] = i
+
+    matrix = np.zeros((len(transactions), len(column_index)), dtype=bool)
+    for i in range(len(transactions)):
+        matrix[i, [column_index[j] for j in transactions[i]]] = True
+    return matrix, column_index
+
+
+# This function calculates the support of a batch of itemsets by ANDing the columns of their items
+# param matrix: The boolean matrix encoding of the transactions
+# param column_index: The dictionary of items to their columns
+# param itemsets: The itemsets to calculate support
+# return: A dictionary of the itemsets (as frozensets) to their support counts
+def get_matrix_supports(matrix, column_index, itemsets):
+    supports = dict.fromkeys((frozenset(i) for i in itemsets), 0)
+
+    # Groups the itemsets by size so that each group is a single array of column indices
+    itemsets_by_size = dict()
+    for i in supports:
+        if i and all(j in column_index for j in i):
+            itemsets_by_size.setdefault(len(i), []).append(i)
+        elif not i:
+            supports[i] = len(matrix)
+
+    for size in itemsets_by_size:
+        group = itemsets_by_size[size]
+        columns = np.array([[column_index[j] for j in i] for i in group])
+        batch_size = max(1, MATRIX_BATCH_CELLS // max(1, len(matrix) * size))
+        for start in range(0, len(group), batch_size):
+            counts = matrix[:, columns[start:start + batch_size]].all(axis=2).sum(axis=0)
+            for i, count in zip(group[start:start + batch_size], counts):
+                supports[i] = int(count)
+
+    return supports
+
+
 # This function prunes itemsets that dont meet minimum support
 # param transactions: The list of transactions
-# return: A list of transactions and a list of distinct items
-def prune_itemsets(transactions, itemsets):
+# param itemsets: The itemsets to prune
+# param support_table: A dictionary which is filled with the support count of every itemset counted if given
+# param matrix: The boolean matrix encoding of the transactions, used to count all itemsets at once if given
+# param column_index: The dictionary of items to their matrix columns
+# return: The itemsets which meet minimum support
+def prune_itemsets(transactions, itemsets, support_table=None, matrix=None, column_index=None):
     newItemsets = []
+    supports = None
+    if matrix is not None:
+        supports = get_matrix_supports(matrix, column_index, itemsets)
     for i in itemsets:
-        if get_support(transactions, i) >= MIN_SUPPORT:
+        if supports is not None:
+            support = supports[frozenset(i)]
+        else:
+            support = get_support(transactions, i)
+        if support_table is not None:
+            support_table[frozenset(i)] = support
+        if support >= MIN_SUPPORT:
             newItemsets.append(i)
     return newItemsets
 
@@ -53,52 +123,203 @@ def get_support(transactions, itemset):
     return support
 
 
+# This function calculates the support of several itemsets with a single pass over the transactions
+# param transactions: The list of transactions
+# param itemsets: The itemsets to calculate support
+# param matrix: The boolean matrix encoding of the transactions, used instead of a pass if given
+# param column_index: The dictionary of items to their matrix columns
+# return: A dictionary of the itemsets (as frozensets) to their support counts
+def get_supports(transactions, itemsets, matrix=None, column_index=None):
+    if matrix is not None:
+        return get_matrix_supports(matrix, column_index, itemsets)
+
+    supports = dict.fromkeys((frozenset(i) for i in itemsets), 0)
+    for j in transactions:
+        for i in supports:
+            if j.issuperset(i):
+                supports[i] += 1
+    return supports
+
+
+# This function orders an itemset as its class label followed by its sorted genes
+# param itemset: An itemset holding one class label
+# return: The itemset as a tuple, or None if it does not hold exactly one class label
+def get_itemset_key(itemset):
+    labels = [i for i in LABELS if i in itemset]
+    if len(labels) != 1:
+        return None
+    return (labels[0],) + tuple(sorted(itemset - {labels[0]}))
+
+
 # This function creates candidate itemsets from the current frequent itemsets
+# Itemsets are ordered with their class label first, so joining only itemsets that share all but their last item
+# keeps exactly one class label per candidate and creates every candidate once. A candidate is pruned if dropping
+# any of its genes leaves an itemset which is not frequent
 # param size: size of candidate itemsets
 # param itemsets: The current frequent itemsets
 # return: the candidate itemsets
 def create_candidate_itemsets(itemsets, size):
     candidates = []
-    for i in itemsets:
-        for j in itemsets:
-            if len(i.union(j)) == size:
-                candidate = i.union(j)
-                if (len(candidate.intersection({'BreastCancer'})) > 0 or len(
-                        candidate.intersection({'ColonCancer'})) > 0) and not (
-                        len(candidate.intersection({'BreastCancer'})) > 0 and
-                        len(candidate.intersection({'ColonCancer'})) > 0):
-                    if candidate not in candidates:
-                        candidates.append(candidate)
+    keys = sorted({key for key in map(get_itemset_key, itemsets) if key is not None and len(key) == size - 1})
+    frequent = set(keys)
+
+    # Itemsets sharing a prefix are adjacent once sorted, so each run of them is joined pairwise
+    start = 0
+    while start < len(keys):
+        end = start + 1
+        while end < len(keys) and keys[end][:-1] == keys[start][:-1]:
+            end += 1
+        for i in range(start, end - 1):
+            for j in range(i + 1, end):
+                candidate = keys[i] + keys[j][-1:]
+                if all(candidate[:l] + candidate[l + 1:] in frequent for l in range(1, size - 2)):
+                    candidates.append(set(candidate))
+        start = end
+
     return candidates
 
 
 # This function mines the rules of the frequent itemsets
+# Supports are looked up in the support table, and antecedents missing from it are counted together in one pass
 # param transactions: The list of transactions
-# param itemset: The itemset to calculate support
+# param itemsets: The frequent itemsets to mine rules from
+# param support_table: A dictionary of itemsets (as frozensets) to support counts, which is extended with the
+# antecedents counted
+# param matrix: The boolean matrix encoding of the transactions, used for counting if given
+# param column_index: The dictionary of items to their matrix columns
 # return: the association rules
-def association_mine(transactions, itemsets):
-    rules = []
+def association_mine(transactions, itemsets, support_table=None, matrix=None, column_index=None):
+    if support_table is None:
+        support_table = dict()
+
+    # Splits each itemset into the antecedent genes and the consequent disease
+    splits = []
     for i in itemsets:
         if i.issuperset({'BreastCancer'}):
-            supportWith = get_support(transactions, i)
-            i.remove('BreastCancer')
-            supportWithout = get_support(transactions, i)
-            confidence = supportWith / supportWithout
-            if confidence >= MIN_CONFIDENCE:
-                rules.append([i, {'BreastCancer'}, supportWith, confidence])
-            i.add('BreastCancer')
+            splits.append((i, frozenset(i - {'BreastCancer'}), {'BreastCancer'}))
         elif i.issuperset({'ColonCancer'}):
-            supportWith = get_support(transactions, i)
-            i.remove('ColonCancer')
-            supportWithout = get_support(transactions, i)
-            confidence = supportWith / supportWithout
-            if confidence >= MIN_CONFIDENCE:
-                rules.append([i, {'ColonCancer'}, supportWith, confidence])
-            i.add('ColonCancer')
+            splits.append((i, frozenset(i - {'ColonCancer'}), {'ColonCancer'}))
+
+    missing = [frozenset(i) for i in itemsets if frozenset(i) not in support_table]
+    missing.extend(antecedent for _, antecedent, _ in splits if antecedent not in support_table)
+    if missing:
+        support_table.update(get_supports(transactions, missing, matrix, column_index))
+
+    rules = []
+    for i, antecedent, consequent in splits:
+        supportWith = support_table[frozenset(i)]
+        supportWithout = support_table[antecedent]
+        confidence = supportWith / supportWithout
+        if confidence >= MIN_CONFIDENCE:
+            rules.append([set(antecedent), consequent, supportWith, confidence])
 
     return rules
 
 
+# This function generates the rules of every consequent of the frequent itemsets (ap-genrules)
+# The consequents of each itemset are grown level by level from the consequents whose rule met minimum confidence,
+# since moving an item from the antecedent to the consequent can only lower confidence. The antecedent supports of
+# a level are counted together and the interestingness measures are computed over whole columns at once
+# param transactions: The list of transactions
+# param frequent_itemsets: The frequent itemsets to generate rules from
+# param support_table: A dictionary of itemsets (as frozensets) to support counts, extended with the itemsets counted
+# param min_confidence: The minimum confidence of a rule
+# param matrix: The boolean matrix encoding of the transactions, used for counting if given
+# param column_index: The dictionary of items to their matrix columns
+# return: The rule table as a dictionary of columns
+def get_rule_table(transactions, frequent_itemsets, support_table, min_confidence=MIN_CONFIDENCE, matrix=None,
+                   column_index=None):
+    antecedents = []
+    consequents = []
+    rule_supports = []
+    antecedent_supports = []
+
+    # Consequents are sorted tuples so the next level is a join of consequents sharing all but their last item
+    levels = [(frozenset(i), [(j,) for j in sorted(i)]) for i in frequent_itemsets if len(i) > 1]
+    while levels:
+        pairs = [(itemset, consequent) for itemset, level in levels for consequent in level]
+        missing = {itemset.difference(j) for itemset, j in pairs}.union(itemset for itemset, _ in pairs)
+        missing = [i for i in missing if i not in support_table]
+        if missing:
+            support_table.update(get_supports(transactions, missing, matrix, column_index))
+
+        with_support = np.array([support_table[itemset] for itemset, _ in pairs], dtype=np.int64)
+        without_support = np.array([support_table[itemset.difference(j)] for itemset, j in pairs], dtype=np.int64)
+        confident = with_support >= min_confidence * without_support
+
+        next_levels = []
+        surviving = dict()
+        for (itemset, consequent), with_count, without_count, keep in zip(pairs, with_support, without_support,
+                                                                          confident):
+            if keep:
+                antecedents.append(itemset.difference(consequent))
+                consequents.append(frozenset(consequent))
+                rule_supports.append(with_count)
+                antecedent_supports.append(without_count)
+                surviving.setdefault(itemset, []).append(consequent)
+
+        for itemset in surviving:
+            kept = surviving[itemset]
+            if len(kept[0]) + 1 >= len(itemset):
+                continue
+            joined = []
+            for i in range(len(kept) - 1):
+                for j in range(i + 1, len(kept)):
+                    if kept[i][:-1] == kept[j][:-1]:
+                        joined.append(kept[i] + kept[j][-1:])
+            if joined:
+                next_levels.append((itemset, joined))
+        levels = next_levels
+
+    missing = [i for i in set(consequents) if i not in support_table]
+    if missing:
+        support_table.update(get_supports(transactions, missing, matrix, column_index))
+    consequent_supports = np.array([support_table[i] for i in consequents], dtype=np.int64)
+
+    return get_rule_measures(antecedents, consequents, np.array(rule_supports, dtype=np.int64),
+                             np.array(antecedent_supports, dtype=np.int64), consequent_supports, len(transactions))
+
+
+# This function computes the interestingness measures of rules from the supports of their parts as columns
+# param antecedents: The antecedents of the rules
+# param consequents: The consequents of the rules
+# param rule_supports: The support counts of the rules
+# param antecedent_supports: The support counts of the antecedents
+# param consequent_supports: The support counts of the consequents
+# param transaction_count: The number of transactions
+# return: The rule table as a dictionary of columns
+def get_rule_measures(antecedents, consequents, rule_supports, antecedent_supports, consequent_supports,
+                      transaction_count):
+    rule_frequency = rule_supports / transaction_count
+    antecedent_frequency = antecedent_supports / transaction_count
+    consequent_frequency = consequent_supports / transaction_count
+    confidence = rule_supports / antecedent_supports
+
+    # Conviction is infinite for rules which always hold
+    with np.errstate(divide='ignore', invalid='ignore'):
+        conviction = np.where(confidence < 1, (1 - consequent_frequency) / (1 - confidence), np.inf)
+
+    rule_table = dict()
+    rule_table['antecedent'] = np.empty(len(antecedents), dtype=object)
+    rule_table['antecedent'][:] = antecedents
+    rule_table['consequent'] = np.empty(len(consequents), dtype=object)
+    rule_table['consequent'][:] = consequents
+    rule_table['support'] = rule_supports
+    rule_table['confidence'] = confidence
+    rule_table['lift'] = confidence / consequent_frequency
+    rule_table['leverage'] = rule_frequency - antecedent_frequency * consequent_frequency
+    rule_table['conviction'] = conviction
+    return rule_table
+
+
+# This function selects the rules of a rule table, for example with a mask such as rule_table['lift'] > 1
+# param rule_table: The rule table as a dictionary of columns
+# param selection: A boolean mask or an array of row indices
+# return: The rule table of the selected rules
+def filter_rule_table(rule_table, selection):
+    return {i: rule_table[i][selection] for i in rule_table}
+
+
 # This function writes all association rules along with their support and confidence to the output file with the
 # given filename
 # param filename: The name for the output file
@@ -117,20 +338,119 @@ def output_to_file(filename, association_rules):
     file.close()
 
 
+# This function writes every rule of a rule table along with its support and measures to the output file with the
+# given filename
+# param filename: The name for the output file
+# param rule_table: The rule table as a dictionary of columns
+# return: void
+def output_rule_table_to_file(filename, rule_table):
+    file = open(filename, 'w')
+    for i in range(len(rule_table['support'])):
+        file.write(str(set(rule_table['antecedent'][i])) + " -> " + str(set(rule_table['consequent'][i])) +
+                   " support: " + str(rule_table['support'][i]) + "% confidence: " +
+                   format(rule_table['confidence'][i] * 100, '.2f') + "% lift: " +
+                   format(rule_table['lift'][i], '.4f') + " leverage: " + format(rule_table['leverage'][i], '.4f') +
+                   " conviction: " + format(rule_table['conviction'][i], '.4f') + "\n")
+    file.close()
+
+
+# This function builds a rule store over mined association rules with inverted indexes of the items of the body and
+# head of the rules, so that template queries only touch the rules holding the queried items
+# Rules are numbered in descending order of support and then confidence, so every index lists rules in that order
+# param association_rules: The association rules for each itemset size, as returned by get_association_rules
+# return: The rule store dictionary
+def build_rule_store(association_rules):
+    rules = sorted((i for j in association_rules for i in j), key=lambda l: (-l[2], -l[3]))
+
+    body_index = dict()
+    head_index = dict()
+    for rule_id, rule in enumerate(rules):
+        for item in rule[0]:
+            body_index.setdefault(item, []).append(rule_id)
+        for item in rule[1]:
+            head_index.setdefault(item, []).append(rule_id)
+
+    rule_store = dict()
+    rule_store['rules'] = rules
+    rule_store['body_index'] = {i: np.array(body_index[i], dtype=np.int64) for i in body_index}
+    rule_store['head_index'] = {i: np.array(head_index[i], dtype=np.int64) for i in head_index}
+    rule_store['size'] = np.array([len(i[0]) + len(i[1]) for i in rules], dtype=np.int64)
+    rule_store['support'] = np.array([i[2] for i in rules], dtype=np.int64)
+    rule_store['confidence'] = np.array([i[3] for i in rules], dtype=float)
+    return rule_store
+
+
+# This function finds the rules of a rule store matching a template, in descending order of support and confidence
+# param rule_store: The rule store dictionary
+# param body_any: Items of which the body must hold at least one
+# param body_all: Items which the body must all hold
+# param head: Items which the head must all hold
+# param min_size: The minimum number of items of the body and head together
+# param min_support: The minimum support of the rules
+# param min_confidence: The minimum confidence of the rules
+# return: The matching rules
+def query_rules(rule_store, body_any=None, body_all=None, head=None, min_size=0, min_support=0, min_confidence=0):
+    empty = np.array([], dtype=np.int64)
+    rule_ids = None
+
+    # Narrows the rules down with the posting lists of the queried items before filtering on the measures
+    if body_any is not None:
+        rule_ids = empty
+        for i in body_any:
+            rule_ids = np.union1d(rule_ids, rule_store['body_index'].get(i, empty))
+    for index, items in (('body_index', body_all), ('head_index', head)):
+        for i in items or ():
+            posting = rule_store[index].get(i, empty)
+            rule_ids = posting if rule_ids is None else np.intersect1d(rule_ids, posting, assume_unique=True)
+    if rule_ids is None:
+        rule_ids = np.arange(len(rule_store['rules']))
+
+    keep = ((rule_store['size'][rule_ids] >= min_size) & (rule_store['support'][rule_ids] >= min_support) &
+            (rule_store['confidence'][rule_ids] >= min_confidence))
+    return [rule_store['rules'][i] for i in rule_ids[keep]]
+
+
+# This function writes a rule store to a file so that it can be queried again without mining
+# param filename: The name of the rule store file
+# param rule_store: The rule store dictionary
+# return: void
+def save_rule_store(filename, rule_store):
+    with open(filename, 'wb') as file:
+        pickle.dump(rule_store, file)
+
+
+# This function reads a rule store from a file
+# param filename: The name of the rule store file
+# return: The rule store dictionary
+def load_rule_store(filename):
+    with open(filename, 'rb') as file:
+        return pickle.load(file)
+
+
 # This function mines the rules of all the frequent itemsets
 # param transactions: The list of transactions
 # param itemset: The itemset to calculate support
 # param min_size: The minimum size of frequent itemset
+# param matrix: The boolean matrix encoding of the transactions, used for counting if given
+# param column_index: The dictionary of items to their matrix columns
+# param support_table: A dictionary which is filled with the support count of every itemset counted if given
+# param frequent_itemsets: A list which is filled with the frequent itemsets of at least the minimum size if given
 # return: the association rules
-def get_association_rules(transactions, itemsets, min_size):
-    pruned_candidates = prune_itemsets(transactions, itemsets)
+def get_association_rules(transactions, itemsets, min_size, matrix=None, column_index=None, support_table=None,
+                          frequent_itemsets=None):
+    if support_table is None:
+        support_table = dict()
+    pruned_candidates = prune_itemsets(transactions, itemsets, support_table, matrix, column_index)
     size = min_size
     association_rules = []
-    while len(create_candidate_itemsets(pruned_candidates, size)) > 0:
-        candidates = create_candidate_itemsets(pruned_candidates, size)
-        pruned_candidates = prune_itemsets(transactions, candidates)
-        association_rules.append(association_mine(transactions, pruned_candidates))
+    candidates = create_candidate_itemsets(pruned_candidates, size)
+    while len(candidates) > 0:
+        pruned_candidates = prune_itemsets(transactions, candidates, support_table, matrix, column_index)
+        if frequent_itemsets is not None:
+            frequent_itemsets.extend(pruned_candidates)
+        association_rules.append(association_mine(transactions, pruned_candidates, support_table, matrix, column_index))
         size += 1
+        candidates = create_candidate_itemsets(pruned_candidates, size)
     return association_rules
 
 
@@ -138,9 +458,16 @@ def get_association_rules(transactions, itemsets, min_size):
 def main():
     input_filename = 'assignment4_input.txt'
     output_filename = 'result.txt'
-    transactions, itemsets = get_input_data(input_filename)
-    association_rules = get_association_rules(transactions, itemsets, MIN_SIZE)
-    output_to_file(output_filename, association_rules)
+    transactions, itemsets, matrix, column_index = get_input_data(input_filename, build_matrix=True)
+    support_table = dict()
+    frequent_itemsets = []
+    association_rules = get_association_rules(transactions, itemsets, MIN_SIZE, matrix, column_index, support_table,
+                                              frequent_itemsets)
+    if RULE_MODE == 'general':
+        rule_table = get_rule_table(transactions, frequent_itemsets, support_table, MIN_CONFIDENCE, matrix, column_index)
+        output_rule_table_to_file(output_filename, rule_table)
+    else:
+        output_to_file(output_filename, association_rules)
 
 
 if __name__ == '__main__':
@@ -2,9 +2,13 @@
 # Project: DBScan
 
 # Import NumPy to use arrays
+import json
 import math
 import numpy as np
 
+# The first bytes of a binary matrix file made by convert_to_binary
+BINARY_MAGIC = b'GENEMAT1'
+
 
 # This function returns the Euclidean distance between two data points x and y
 # param x: A data point
@@ -18,9 +22,13 @@ def distance(x, y):
 
 
 # This function reads all data points from the input file and returns them in an array
+# A binary matrix file made by convert_to_binary is memory mapped instead of parsed, without the id column
 # param filename: The name of the input file
 # return: An array of data points
 def get_input_data(filename):
+    if is_binary_input(filename):
+        return get_binary_input_data(filename)[0][:, 1:]
+
     data = []
     with open(filename) as file:
         for line in file.readlines():
@@ -31,6 +39,53 @@ def get_input_data(filename):
     return np.array(data)
 
 
+# This function converts a tab separated input file to a binary matrix file that can be memory mapped
+# The file holds a magic number, the length of a JSON header with the shape, data type, ids (first column) and ground
+# truth (second column), the header itself padded to 64 bytes and then the matrix of every column in row major order
+# param input_filename: The name of the tab separated input file
+# param output_filename: The name of the binary file
+# param dtype: The data type of the matrix, float64 or float32
+# return: void
+def convert_to_binary(input_filename, output_filename, dtype=np.float64):
+    rows = []
+    with open(input_filename) as file:
+        for line in file:
+            if line.strip():
+                rows.append(line.strip('\n').split('\t'))
+    matrix = np.array(rows, dtype=dtype)
+
+    header = json.dumps({'shape': list(matrix.shape), 'dtype': np.dtype(dtype).str,
+                         'ids': [i[0] for i in rows], 'ground_truth': [i[1] if len(i) > 1 else '' for i in rows]})
+    header = header.encode()
+    header += b' ' * (-(len(BINARY_MAGIC) + 8 + len(header)) % 64)
+    with open(output_filename, 'wb') as file:
+        file.write(BINARY_MAGIC)
+        file.write(len(header).to_bytes(8, 'little'))
+        file.write(header)
+        file.write(np.ascontiguousarray(matrix).tobytes())
+
+
+# This function checks whether a file is in the binary matrix format
+# param filename: The name of the file
+# return: the boolean value
+def is_binary_input(filename):
+    with open(filename, 'rb') as file:
+        return file.read(len(BINARY_MAGIC)) == BINARY_MAGIC
+
+
+# This function memory maps the matrix of a binary matrix file without copying it
+# param filename: The name of the binary file
+# return: A read only memory mapped matrix of every column and the header dictionary
+def get_binary_input_data(filename):
+    with open(filename, 'rb') as file:
+        file.read(len(BINARY_MAGIC))
+        header_length = int.from_bytes(file.read(8), 'little')
+        header = json.loads(file.read(header_length))
+    matrix = np.memmap(filename, dtype=np.dtype(header['dtype']), mode='r',
+                       offset=len(BINARY_MAGIC) + 8 + header_length, shape=tuple(header['shape']))
+    return matrix, header
+
+
 # This function generates a matrix of distance between each pair of points
 # param data: An array of data points
 # return: A distance matrix
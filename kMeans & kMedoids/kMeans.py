@@ -2,10 +2,32 @@
 # Project: kMeans
 
 # Import NumPy to use arrays
+import json
 import numpy as np
-import  math
+from multiprocessing import shared_memory
+from concurrent.futures import ProcessPoolExecutor
 
 k = 10
+# The first bytes of a binary matrix file made by convert_to_binary
+BINARY_MAGIC = b'GENEMAT1'
+# Whether main streams mini-batches from the input file instead of loading it
+MINIBATCH = False
+# The number of data points per mini-batch, the maximum number of mini-batches and the centroid movement to stop at
+MINIBATCH_SIZE = 1000
+MINIBATCH_BUDGET = 100
+MINIBATCH_TOLERANCE = 1e-4
+# Whether main uses the bound-accelerated k-means, which gives the same clusters as the standard one
+ACCELERATED = False
+# The relative slack a distance bound must clear to skip a data point, which absorbs floating point error
+BOUND_MARGIN = 1e-9
+# The number of k-means++ seeded runs main keeps the best of, and the number of worker processes running them
+# (None to use every core). A single run uses the sequential initial clusters
+RESTARTS = 1
+WORKER_COUNT = None
+
+# The data matrix shared with the worker processes of the restarts
+shared_data = None
+shared_data_memory = None
 
 
 # This function returns the Euclidean distance between two data points x and y
@@ -13,127 +35,392 @@ k = 10
 # param y: A data point
 # return: The Euclidean distance between x and y
 def distance(x, y):
-    sum = 0
-    for i in range(len(x)):
-        sum += pow(float(x[i]) - float(y[i]), 2)
-    return float(format(math.sqrt(sum), '.4f'))
+    difference = np.asarray(x, dtype=np.float64) - np.asarray(y, dtype=np.float64)
+    return float(format(np.sqrt(np.dot(difference, difference)), '.4f'))
+
+
+# This function returns the squared Euclidean distance between every data point and every mean point
+# param data: A matrix of data points
+# param means: A matrix of mean points
+# return: An n x k matrix of squared distances
+def squared_distances(data, means):
+    distances = np.einsum('ij,ij->i', data, data)[:, None] - 2 * (data @ means.T) + np.einsum('ij,ij->i', means, means)
+    return np.maximum(distances, 0)
+
 
 # This function reads all data points from the input file and returns them in an array
+# A binary matrix file made by convert_to_binary is memory mapped instead of parsed
 # param filename: The name of the input file
-# return: An array of data points
+# return: A matrix of data points
 def get_input_data(filename):
+    if is_binary_input(filename):
+        return get_binary_input_data(filename)[0]
+
     data = []
     with open(filename) as file:
         for line in file.readlines():
             temp = line.strip('\n').split('\t')
             data.append(temp)
-    return np.array(data)
+    return np.array(data, dtype=np.float64)
+
+
+# This function converts a tab separated input file to a binary matrix file that can be memory mapped
+# The file holds a magic number, the length of a JSON header with the shape, data type, ids (first column) and ground
+# truth (second column), the header itself padded to 64 bytes and then the matrix of every column in row major order
+# param input_filename: The name of the tab separated input file
+# param output_filename: The name of the binary file
+# param dtype: The data type of the matrix, float64 or float32
+# return: void
+def convert_to_binary(input_filename, output_filename, dtype=np.float64):
+    rows = []
+    with open(input_filename) as file:
+        for line in file:
+            if line.strip():
+                rows.append(line.strip('\n').split('\t'))
+    matrix = np.array(rows, dtype=dtype)
+
+    header = json.dumps({'shape': list(matrix.shape), 'dtype': np.dtype(dtype).str,
+                         'ids': [i[0] for i in rows], 'ground_truth': [i[1] if len(i) > 1 else '' for i in rows]})
+    header = header.encode()
+    header += b' ' * (-(len(BINARY_MAGIC) + 8 + len(header)) % 64)
+    with open(output_filename, 'wb') as file:
+        file.write(BINARY_MAGIC)
+        file.write(len(header).to_bytes(8, 'little'))
+        file.write(header)
+        file.write(np.ascontiguousarray(matrix).tobytes())
+
+
+# This function checks whether a file is in the binary matrix format
+# param filename: The name of the file
+# return: the boolean value
+def is_binary_input(filename):
+    with open(filename, 'rb') as file:
+        return file.read(len(BINARY_MAGIC)) == BINARY_MAGIC
+
+
+# This function memory maps the matrix of a binary matrix file without copying it
+# param filename: The name of the binary file
+# return: A read only memory mapped matrix of every column and the header dictionary
+def get_binary_input_data(filename):
+    with open(filename, 'rb') as file:
+        file.read(len(BINARY_MAGIC))
+        header_length = int.from_bytes(file.read(8), 'little')
+        header = json.loads(file.read(header_length))
+    matrix = np.memmap(filename, dtype=np.dtype(header['dtype']), mode='r',
+                       offset=len(BINARY_MAGIC) + 8 + header_length, shape=tuple(header['shape']))
+    return matrix, header
 
 
 # This function creates k initial clusters by partitioning the input data sequentially with equal size
 # param data: An array of data points
-# return: An array of initial clusters
+# return: An array of the initial cluster index of each data point
 def generate_initial_clusters(data):
-    clusters = []
-
     # separates data into clusters
     n = int(len(data)/k)
-    for i in range(0, len(data), n):
-        clusters.append(data[i : i + n])
-    return clusters
+    return np.arange(len(data)) // n
 
 
 # This function calculates the mean points of the current set of clusters and return them in an array
-# param clusters: An array of current clusters
-# return: An array of mean points of the clusters
-def calculate_means(clusters):
-    means = []
+# param data: A matrix of data points
+# param labels: An array of the cluster index of each data point
+# param means: The current mean points, kept for clusters which have no data points if given
+# return: A matrix of mean points of the clusters
+def calculate_means(data, labels, means=None):
+    cluster_count = len(means) if means is not None else labels.max() + 1
+    counts = np.bincount(labels, minlength=cluster_count)
+    sums = np.zeros((cluster_count, data.shape[1]))
+    np.add.at(sums, labels, data)
 
-    # calculates means of clusters
-    for i in clusters:
-        temp = list()
-        for j in range(len(i[0])):
-            sum = 0
-            for k in range(len(i)):
-                sum += float(i[k][j])
-            temp.append(sum/len(i))
-        means.append(temp)
-
-    return np.array(means)
+    new_means = means.copy() if means is not None else np.full((cluster_count, data.shape[1]), np.nan)
+    new_means[counts > 0] = sums[counts > 0] / counts[counts > 0, None]
+    return new_means
 
 
 # This function generates a new set of clusters by assigning each data point to the nearest mean point
 # param means: An array of mean points
 # param data: An array of data points
-# return: An array of new clusters
+# return: An array of the new cluster index of each data point
 def generate_new_clusters(means, data):
-    clusters = [[] for _ in range(k)]
-
-    # creating new clusters based on new means
-    for x in data:
-        index = 0
-        min_idx = 0
-        min = float("inf")
-        for y in means:
-            dist = distance(x, y)
-            if dist < min:
-                min = dist
-                min_idx = index
-            index +=1
-        clusters[min_idx].append(x)
-    return clusters
+    return np.argmin(squared_distances(data, means), axis=1)
+
+
+# This function counts the data points whose cluster differs between two sets of clusters
+# param oldClusters: An array of the previous cluster index of each data point
+# param newClusters: An array of the new cluster index of each data point
+# return: The number of data points which moved
+def count_moved_points(oldClusters, newClusters):
+    return int(np.count_nonzero(oldClusters != newClusters))
 
 
 # This function checks whether the new set of clusters have changed from the previous set of clusters
-# param oldClusters: An array of the previous set of clusters
-# param newClusters: An array of the new set of clusters
+# param oldClusters: An array of the previous cluster index of each data point
+# param newClusters: An array of the new cluster index of each data point
 # return: the boolean value
 def has_clusters_changed(oldClusters, newClusters):
-    for i in range(len(oldClusters)):
-        for j in oldClusters[i]:
-            if not any((j == k).all() for k in newClusters[i]):
-                return True
-    return False
+    return count_moved_points(oldClusters, newClusters) > 0
+
 
+# This function groups the row numbers of the data points by cluster
+# param clusters: An array of the cluster index of each data point
+# param cluster_count: The number of clusters
+# return: A list of arrays of the row numbers in each cluster
+def get_cluster_indices(clusters, cluster_count=k):
+    order = np.argsort(clusters, kind='stable')
+    counts = np.bincount(clusters, minlength=cluster_count)
+    return np.split(order, np.cumsum(counts)[:-1])
 
 
 # This function implements the k-means algorithm by taking the input data
 # It iteratively generates a new set of clusters until they do not change from the previous set of clusters
 # param data: An array of data points
-# return: An array of output clusters
+# return: An array of the output cluster index of each data point
 def extract_kmean_clusters(data):
     old_clusters = generate_initial_clusters(data)
-    means = calculate_means(old_clusters)
+    means = calculate_means(data, old_clusters)
+    new_clusters, means, iterations = run_kmeans(data, means, old_clusters)
+    return new_clusters
+
+
+# This function iterates k-means from the given mean points until the clusters do not change
+# param data: An array of data points
+# param means: A matrix of the initial mean points
+# param old_clusters: An array of the cluster index of each data point the mean points came from, if any
+# return: An array of the output cluster index of each data point, the final mean points and the number of iterations
+def run_kmeans(data, means, old_clusters=None):
+    if old_clusters is None:
+        old_clusters = np.full(len(data), -1)
     new_clusters = generate_new_clusters(means, data)
+    iterations = 1
 
     while has_clusters_changed(old_clusters, new_clusters):
         old_clusters = new_clusters
-        means = calculate_means(old_clusters)
-        new_clusters = generate_new_clusters(means,data)
-    return new_clusters
+        means = calculate_means(data, old_clusters, means)
+        new_clusters = generate_new_clusters(means, data)
+        iterations += 1
+    return new_clusters, means, iterations
+
+
+# This function returns the sum of squared distances of the data points to the mean point of their cluster
+# param data: An array of data points
+# param clusters: An array of the cluster index of each data point
+# param means: A matrix of mean points
+# return: The sum of squared errors
+def get_sse(data, clusters, means):
+    return float(((data - means[clusters]) ** 2).sum())
+
+
+# This function picks k initial mean points with k-means++, each data point being picked with probability
+# proportional to its squared distance from the nearest mean point picked so far
+# param data: An array of data points
+# param rng: The NumPy random generator
+# return: A matrix of the initial mean points
+def get_kmeans_plus_plus_means(data, rng):
+    indices = [rng.integers(len(data))]
+    nearest = squared_distances(data, data[indices]).ravel()
+    for _ in range(1, k):
+        total = nearest.sum()
+        index = rng.choice(len(data), p=nearest / total) if total > 0 else rng.integers(len(data))
+        indices.append(index)
+        nearest = np.minimum(nearest, squared_distances(data, data[[index]]).ravel())
+    return data[indices].copy()
+
+
+# This function attaches a worker process to the shared data matrix
+# param name: The name of the shared memory block
+# param shape: The shape of the data matrix
+# param dtype: The data type of the data matrix
+# return: void
+def attach_shared_data(name, shape, dtype):
+    global shared_data, shared_data_memory
+    shared_data_memory = shared_memory.SharedMemory(name=name)
+    shared_data = np.ndarray(shape, dtype=dtype, buffer=shared_data_memory.buf)
+
+
+# This function runs one k-means++ seeded k-means restart on the shared data matrix
+# param seed: The seed sequence of the restart
+# return: The sum of squared errors, the number of iterations and the cluster index of each data point
+def run_restart(seed):
+    means = get_kmeans_plus_plus_means(shared_data, np.random.default_rng(seed))
+    clusters, means, iterations = run_kmeans(shared_data, means)
+    return get_sse(shared_data, clusters, means), iterations, clusters
+
+
+# This function runs independent k-means++ seeded k-means restarts on a process pool and keeps the lowest SSE one
+# The data matrix is placed in shared memory once and every worker views it without a copy
+# param data: An array of data points
+# param restarts: The number of restarts
+# param workers: The number of worker processes, None to use every core
+# param seed: The seed the restarts' seeds are derived from
+# return: An array of the output cluster index of each data point of the best restart and a list of the
+# (SSE, iterations) of each restart
+def extract_restarted_kmean_clusters(data, restarts=RESTARTS, workers=WORKER_COUNT, seed=None):
+    memory = shared_memory.SharedMemory(create=True, size=max(1, data.nbytes))
+    try:
+        np.ndarray(data.shape, dtype=data.dtype, buffer=memory.buf)[:] = data
+        seeds = np.random.SeedSequence(seed).spawn(restarts)
+        with ProcessPoolExecutor(workers, initializer=attach_shared_data,
+                                 initargs=(memory.name, data.shape, data.dtype.str)) as executor:
+            results = list(executor.map(run_restart, seeds))
+    finally:
+        memory.close()
+        memory.unlink()
+
+    best = min(range(len(results)), key=lambda l: results[l][0])
+    return results[best][2], [(i[0], i[1]) for i in results]
+
+
+# This function assigns data points to their nearest mean point and returns the distances to the nearest and second
+# nearest mean point
+# param means: A matrix of mean points
+# param data: A matrix of data points
+# return: An array of cluster indices, an array of nearest distances and an array of second nearest distances
+def assign_with_bounds(means, data):
+    distances = squared_distances(data, means)
+    clusters = np.argmin(distances, axis=1)
+    rows = np.arange(len(data))
+    nearest = distances[rows, clusters]
+    distances[rows, clusters] = np.inf
+    return clusters, np.sqrt(nearest), np.sqrt(distances.min(axis=1))
+
+
+# This function implements the k-means algorithm with Hamerly's bounds, producing the same clusters as
+# extract_kmean_clusters. Each data point keeps an upper bound on the distance to its own mean point and a lower
+# bound on the distance to any other one. A data point is skipped while its upper bound is below both its lower bound
+# and half the distance from its mean point to the nearest other mean point, since then its cluster cannot change
+# param data: An array of data points
+# return: An array of the output cluster index of each data point and the number of distance evaluations performed
+# in each iteration, against the n * k of an iteration of extract_kmean_clusters
+def extract_accelerated_kmean_clusters(data):
+    old_clusters = generate_initial_clusters(data)
+    means = calculate_means(data, old_clusters)
+    new_clusters, upper, lower = assign_with_bounds(means, data)
+    evaluations = []
+
+    while has_clusters_changed(old_clusters, new_clusters):
+        old_clusters = new_clusters.copy()
+        new_means = calculate_means(data, old_clusters, means)
+        moved = np.sqrt(((new_means - means) ** 2).sum(axis=1))
+        means = new_means
+
+        # Moves the bounds by how far the mean points moved, using the largest move of any other mean point
+        upper += moved[new_clusters]
+        largest = np.argmax(moved)
+        other_moved = np.full(len(means), moved[largest])
+        other_moved[largest] = np.partition(moved, -2)[-2] if len(means) > 1 else 0
+        lower -= other_moved[new_clusters]
+
+        center_distances = np.sqrt(squared_distances(means, means))
+        np.fill_diagonal(center_distances, np.inf)
+        bound = np.maximum(center_distances.min(axis=1)[new_clusters] / 2, lower)
+        bound -= BOUND_MARGIN * (1 + np.abs(bound))
+
+        # Tightens the upper bound of the data points which fail the test and fully reassigns those still failing
+        tighten = np.flatnonzero(upper >= bound)
+        upper[tighten] = np.sqrt(((data[tighten] - means[new_clusters[tighten]]) ** 2).sum(axis=1))
+        reassign = tighten[upper[tighten] >= bound[tighten]]
+        new_clusters[reassign], upper[reassign], lower[reassign] = assign_with_bounds(means, data[reassign])
+
+        evaluations.append(len(tighten) + len(reassign) * len(means))
+    return new_clusters, evaluations
+
+
+# This function finds where each line of the input file starts so that data points can be read in any order
+# param filename: The name of the input file
+# return: An array of the byte offset of each line
+def get_line_offsets(filename):
+    offsets = []
+    position = 0
+    with open(filename, 'rb') as file:
+        for line in file:
+            if line.strip():
+                offsets.append(position)
+            position += len(line)
+    return np.array(offsets, dtype=np.int64)
+
+
+# This function reads the data points on the given lines of the input file
+# param file: The input file opened in binary mode
+# param offsets: The byte offset of each line
+# param indices: The row numbers of the data points to read
+# return: A matrix of the data points
+def read_data_points(file, offsets, indices):
+    data = []
+    for i in indices:
+        file.seek(offsets[i])
+        data.append(file.readline().decode().strip('\n').split('\t'))
+    return np.array(data, dtype=np.float64)
+
+
+# This function implements mini-batch k-means which streams random batches of data points from the input file
+# Each centroid moves towards the mean of its points in a batch with a learning rate of one over the number of points
+# it has been assigned so far, so only a batch of data points is held in memory at a time
+# param filename: The name of the input file
+# param batch_size: The number of data points per batch
+# param max_batches: The maximum number of batches
+# param tolerance: The largest centroid movement in a batch at which the centroids are considered converged
+# param seed: The seed of the random batches
+# param label_all: Whether to assign every data point of the file to its nearest centroid after training
+# return: An array of the output cluster index of each data point (None if label_all is not set) and the centroids
+def extract_minibatch_kmean_clusters(filename, batch_size=MINIBATCH_SIZE, max_batches=MINIBATCH_BUDGET,
+                                     tolerance=MINIBATCH_TOLERANCE, seed=None, label_all=True):
+    rng = np.random.default_rng(seed)
+    offsets = get_line_offsets(filename)
+    batch_size = min(batch_size, len(offsets))
+
+    with open(filename, 'rb') as file:
+        means = read_data_points(file, offsets, np.sort(rng.choice(len(offsets), k, replace=False)))
+        counts = np.zeros(k)
+
+        for _ in range(max_batches):
+            batch = read_data_points(file, offsets, np.sort(rng.choice(len(offsets), batch_size, replace=False)))
+            clusters = generate_new_clusters(means, batch)
+
+            # Applying the per point updates of each centroid in turn amounts to a weighted mean of the centroid and
+            # its points in the batch
+            batch_counts = np.bincount(clusters, minlength=k)
+            batch_sums = np.zeros_like(means)
+            np.add.at(batch_sums, clusters, batch)
+            counts += batch_counts
+            updated = batch_counts > 0
+            new_means = means.copy()
+            new_means[updated] += (batch_sums[updated] - batch_counts[updated, None] * means[updated]) / counts[updated, None]
+
+            movement = np.sqrt(((new_means - means) ** 2).sum(axis=1)).max()
+            means = new_means
+            if movement < tolerance:
+                break
+
+        if not label_all:
+            return None, means
+
+        # Labels the whole file reading it sequentially one batch of lines at a time
+        labels = np.empty(len(offsets), dtype=np.int64)
+        file.seek(0)
+        batch = []
+        start = 0
+        for line in file:
+            if line.strip():
+                batch.append(line.decode().strip('\n').split('\t'))
+            if len(batch) == batch_size:
+                labels[start:start + len(batch)] = generate_new_clusters(means, np.array(batch, dtype=np.float64))
+                start += len(batch)
+                batch = []
+        if batch:
+            labels[start:start + len(batch)] = generate_new_clusters(means, np.array(batch, dtype=np.float64))
+    return labels, means
 
 
 # This function writes the output clusters to a file, each cluster per line, following the format such as
 # 4 : { 1, 2, 5, 6 } where 4 is the total number of data points in the cluster
 # and { 1, 2, 5, 6 } represent the row numbers of the data points in the cluster
 # param filename: The output filename
-# param clusters: The output clusters
+# param clusters: An array of the output cluster index of each data point
 # param input_data: An array of input data points
 def output_to_file(filename, clusters, input_data):
 
     file = open(filename, 'w')
-    for i in clusters:
-        file.write(str(len(i)) + ":{")
-        count = 0
-        for j in i:
-            for k in range(len(input_data)):
-                if (input_data[k] == j).all() :
-                    if count < len(i) - 1:
-                        file.write(str(k) + ",")
-                    else:
-                        file.write(str(k))
-            count += 1
-        file.write("}\n")
+    for i in get_cluster_indices(clusters):
+        file.write(str(len(i)) + ":{" + ",".join(str(j) for j in i) + "}\n")
 
     file.close()
 
@@ -142,8 +429,23 @@ def output_to_file(filename, clusters, input_data):
 def main():
     input_filename = 'assignment2_input.txt'
     output_filename = 'result.txt'
+    if MINIBATCH:
+        gene_clusters, means = extract_minibatch_kmean_clusters(input_filename)
+        output_to_file(output_filename, gene_clusters, None)
+        return
     genes = get_input_data(input_filename)
-    gene_clusters = extract_kmean_clusters(genes)
+    if RESTARTS > 1:
+        gene_clusters, report = extract_restarted_kmean_clusters(genes, RESTARTS, WORKER_COUNT)
+        for i in range(len(report)):
+            print("restart " + str(i + 1) + ": SSE " + format(report[i][0], '.4f') + " after " + str(report[i][1]) +
+                  " iterations")
+    elif ACCELERATED:
+        gene_clusters, evaluations = extract_accelerated_kmean_clusters(genes)
+        for i in range(len(evaluations)):
+            print("iteration " + str(i + 1) + ": " + str(evaluations[i]) + " of " + str(len(genes) * k) +
+                  " distance evaluations")
+    else:
+        gene_clusters = extract_kmean_clusters(genes)
     output_to_file(output_filename,gene_clusters,genes)
 
 
@@ -3,9 +3,24 @@
 
 # Import NumPy to use arrays
 import math
+import time
 import numpy as np
+# The binary matrix format is shared with kMeans, which is in the same directory
+from kMeans import convert_to_binary, is_binary_input, get_binary_input_data
 
 k = 10
+# The algorithm used by main, either 'kmedoids' or 'pam' on the full distance matrix, or 'clara' or 'clarans' which
+# compute distances on demand
+MEDOID_MODE = 'kmedoids'
+# The number of candidate medoids whose swaps are evaluated together by PAM, which bounds its working memory
+PAM_CANDIDATE_BATCH = 1024
+# The number of samples of CLARA and the number of data points in each
+CLARA_SAMPLES = 5
+CLARA_SAMPLE_SIZE = 40 + 2 * k
+# The number of local searches of CLARANS and the number of random swaps tried before a local search stops
+# (None for max(250, 1.25% of k(n - k)))
+CLARANS_LOCAL_SEARCHES = 2
+CLARANS_MAX_NEIGHBORS = None
 
 
 # This function returns the Euclidean distance between two data points x and y
@@ -20,9 +35,13 @@ def distance(x, y):
 
 
 # This function reads all data points from the input file and returns them in an array
+# A binary matrix file made by convert_to_binary is memory mapped instead of parsed
 # param filename: The name of the input file
 # return: An array of data points
 def get_input_data(filename):
+    if is_binary_input(filename):
+        return get_binary_input_data(filename)[0]
+
     data = []
     with open(filename) as file:
         for line in file.readlines():
@@ -35,15 +54,14 @@ def get_input_data(filename):
 # param data: An array of data points
 # return: A distance matrix
 def generate_distance_matrix(data):
-    # initializes nxn matrix
-    distance_matrix = [[[] for _ in range(len(data))] for _ in range(len(data))]
+    data = np.asarray(data, dtype=float)
+    distance_matrix = np.empty((len(data), len(data)))
 
-    # creates distance matrix
+    # creates distance matrix one row at a time, rounded like distance
     for x in range(len(data)):
-        for y in range(len(data)):
-            distance_matrix[x][y] = distance(data[x], data[y])
+        distance_matrix[x] = np.sqrt(((data - data[x]) ** 2).sum(axis=1))
 
-    return np.array(distance_matrix)
+    return np.round(distance_matrix, 4)
 
 
 # This function selects k points of the smallest sum of distance as initial medoids
@@ -68,65 +86,288 @@ def get_initial_medoids(distance_matrix):
 
 
 # This function selects k new medoids from the current set of k clusters
-# param clusters: An array of current clusters
+# The new medoid of a cluster is the member with the smallest sum of distance to the other members
+# param clusters: An array of the current cluster index of each data point
 # param distance_matrix: A matrix of distance between each pair of points
 # return: An array of indices of the new medoids of the current clusters
 def get_new_medoids(clusters, distance_matrix):
-    medoid_indices = []
+    medoid_indices = np.full(k, -1)
 
     # for each cluster finds a better medoid
-    for i in clusters:
-        min = float("inf")
-        mindex = -1
-        for j in i:
-            sum = 0
-            for l in i:
-                sum += distance_matrix[j][l]
-            if sum < min:
-                min = sum
-                mindex = j
-        medoid_indices.append(mindex)
+    for i in range(k):
+        members = np.flatnonzero(clusters == i)
+        if len(members):
+            medoid_indices[i] = members[np.argmin(distance_matrix[np.ix_(members, members)].sum(axis=1))]
 
     return medoid_indices
 
 
 # This function generates a new set of clusters by assigning each data point to the nearest medoid point
 # param medoid_indices: An array of medoids
-# param data: An array of data points
 # param distance_matrix: A matrix of distance between each pair of points
-# return: An array of new clusters
-def generate_new_clusters(medoid_indices, data, distance_matrix):
-    clusters = [[] for _ in range(k)]
+# return: An array of the new cluster index of each data point
+def generate_new_clusters(medoid_indices, distance_matrix):
+    return np.argmin(distance_matrix[:, medoid_indices], axis=1)
 
-    # for each point, determines its new cluster
-    for i in range(len(data)):
-        min = distance_matrix[i][medoid_indices[0]]
-        mindex = 0
-        # commpares distance with each medoid
-        for j in range(1,k):
-            if distance_matrix[i][medoid_indices[j]] < min:
-                min = distance_matrix[i][medoid_indices[j]]
-                mindex = j
-        clusters[mindex].append(i)
 
-    return clusters
+# This function counts the data points whose cluster differs between two sets of clusters
+# param oldClusters: An array of the previous cluster index of each data point
+# param newClusters: An array of the new cluster index of each data point
+# return: The number of data points which moved
+def count_moved_points(oldClusters, newClusters):
+    return int(np.count_nonzero(oldClusters != newClusters))
 
 
 # This function implements the k-medoids algorithm by taking the input data
 # It iteratively generates a new set of clusters until they do not change from the previous set of clusters
 # param data: An array of data points
+# param report: A list which is filled with the seconds taken and points moved by each iteration if given
 # return: An array of output clusters
-def extract_kmedoid_clusters(data):
+def extract_kmedoid_clusters(data, report=None):
     distance_matrix = generate_distance_matrix(data)
+    medoids_indices, new_clusters = run_kmedoids(distance_matrix, report)
+    return get_medoid_clusters(new_clusters)
+
+
+# This function iterates k-medoids over a distance matrix until the clusters do not change
+# param distance_matrix: A matrix of distance between each pair of points
+# param report: A list which is filled with the seconds taken and points moved by each iteration if given
+# return: An array of indices of the medoids and an array of the output cluster index of each data point
+def run_kmedoids(distance_matrix, report=None):
+    if report is None:
+        report = []
     medoids_indices = get_initial_medoids(distance_matrix)
-    clusters = generate_new_clusters(medoids_indices, data, distance_matrix)
-    medoids_indices = get_new_medoids(clusters, distance_matrix)
-    new_clusters = generate_new_clusters(medoids_indices, data, distance_matrix)
-    while clusters != new_clusters:
+    new_clusters = generate_new_clusters(medoids_indices, distance_matrix)
+    moved = len(distance_matrix)
+    while moved > 0:
+        start = time.perf_counter()
         clusters = new_clusters
         medoids_indices = get_new_medoids(clusters, distance_matrix)
-        new_clusters = generate_new_clusters(medoids_indices, data, distance_matrix)
-    return new_clusters
+        new_clusters = generate_new_clusters(medoids_indices, distance_matrix)
+        moved = count_moved_points(clusters, new_clusters)
+        report.append((time.perf_counter() - start, moved))
+    return medoids_indices, new_clusters
+
+
+# This function finds the nearest and second nearest medoid of every point
+# param distance_matrix: A matrix of distance between each pair of points
+# param medoid_indices: An array of medoids
+# return: An array of the index of the nearest medoid of each point and arrays of the distances to the nearest and
+# second nearest medoid
+def get_nearest_medoids(distance_matrix, medoid_indices):
+    distances = distance_matrix[:, medoid_indices]
+    rows = np.arange(len(distance_matrix))
+    order = np.argsort(distances, axis=1, kind='stable')
+    second = distances[rows, order[:, 1]] if len(medoid_indices) > 1 else np.full(len(rows), np.inf)
+    return order[:, 0], distances[rows, order[:, 0]], second
+
+
+# This function selects k initial medoids with the BUILD phase of PAM, greedily adding the point which lowers the
+# total distance of the points to their nearest medoid the most
+# param distance_matrix: A matrix of distance between each pair of points
+# return: An array of indices of the initial medoids
+def get_build_medoids(distance_matrix):
+    medoid_indices = [int(np.argmin(distance_matrix.sum(axis=1)))]
+    nearest_distance = distance_matrix[:, medoid_indices[0]].copy()
+    for _ in range(1, k):
+        # Computes the gains in batches of candidates like SWAP to bound the working memory
+        gains = np.empty(len(distance_matrix))
+        for start in range(0, len(distance_matrix), PAM_CANDIDATE_BATCH):
+            candidates = slice(start, start + PAM_CANDIDATE_BATCH)
+            gains[candidates] = np.maximum(nearest_distance[:, None] - distance_matrix[:, candidates], 0).sum(axis=0)
+        gains[medoid_indices] = -1
+        medoid_indices.append(int(np.argmax(gains)))
+        nearest_distance = np.minimum(nearest_distance, distance_matrix[:, medoid_indices[-1]])
+    return medoid_indices
+
+
+# This function computes the change in total distance of swapping each medoid for each candidate point (FastPAM1)
+# For a candidate every point either moves to the candidate or stays with its nearest medoid, unless that medoid is
+# the one removed, in which case it falls back to its second nearest one, so all k swaps come from one pass with the
+# points grouped by their nearest medoid
+# param distance_matrix: A matrix of distance between each pair of points
+# param nearest: An array of the index of the nearest medoid of each point
+# param nearest_distance: An array of the distance of each point to its nearest medoid
+# param second_distance: An array of the distance of each point to its second nearest medoid
+# param candidates: An array of the candidate points
+# return: A k x candidates matrix of the change in total distance of each swap
+def get_swap_deltas(distance_matrix, nearest, nearest_distance, second_distance, candidates):
+    order = np.argsort(nearest, kind='stable')
+    nearest_distance = nearest_distance[order, None]
+    candidate_distances = distance_matrix[np.ix_(order, candidates)]
+    closer = np.minimum(candidate_distances - nearest_distance, 0)
+    removed = np.minimum(candidate_distances, second_distance[order, None]) - nearest_distance - closer
+
+    # Sums the loss of removing each medoid over the points it holds, skipping medoids which hold no points
+    counts = np.bincount(nearest, minlength=k)
+    starts = np.cumsum(counts) - counts
+    deltas = np.tile(closer.sum(axis=0), (k, 1))
+    deltas[counts > 0] += np.add.reduceat(removed, starts[counts > 0], axis=0)
+    return deltas
+
+
+# This function implements PAM with the FastPAM improvements. After BUILD, each SWAP iteration evaluates every
+# candidate against all k medoids at once (FastPAM1) and then applies the best swap found for each medoid while it
+# still lowers the total distance (FastPAM2), instead of a single swap per iteration
+# param distance_matrix: A matrix of distance between each pair of points
+# return: An array of indices of the medoids and an array of output clusters
+def run_pam(distance_matrix):
+    medoid_indices = get_build_medoids(distance_matrix)
+    nearest, nearest_distance, second_distance = get_nearest_medoids(distance_matrix, medoid_indices)
+
+    while True:
+        # Finds the best candidate for each medoid in batches of candidates
+        best_delta = np.zeros(k)
+        best_candidate = np.full(k, -1)
+        for start in range(0, len(distance_matrix), PAM_CANDIDATE_BATCH):
+            candidates = np.arange(start, min(start + PAM_CANDIDATE_BATCH, len(distance_matrix)))
+            deltas = get_swap_deltas(distance_matrix, nearest, nearest_distance, second_distance, candidates)
+            deltas[:, np.isin(candidates, medoid_indices)] = np.inf
+            batch_best = np.argmin(deltas, axis=1)
+            improved = deltas[np.arange(k), batch_best] < best_delta
+            best_delta[improved] = deltas[np.arange(k), batch_best][improved]
+            best_candidate[improved] = candidates[batch_best[improved]]
+
+        # Applies the swaps from the best one down, re-evaluating each against the medoids swapped so far
+        swapped = False
+        for i in np.argsort(best_delta):
+            if best_delta[i] >= 0 or best_candidate[i] in medoid_indices:
+                continue
+            delta = get_swap_deltas(distance_matrix, nearest, nearest_distance, second_distance, best_candidate[[i]])
+            if delta[i, 0] < -1e-12:
+                medoid_indices[i] = int(best_candidate[i])
+                nearest, nearest_distance, second_distance = get_nearest_medoids(distance_matrix, medoid_indices)
+                swapped = True
+        if not swapped:
+            break
+
+    return medoid_indices, get_medoid_clusters(nearest)
+
+
+# This function implements PAM by taking the input data
+# param data: An array of data points
+# return: An array of output clusters
+def extract_pam_clusters(data):
+    distance_matrix = generate_distance_matrix(data)
+    medoid_indices, clusters = run_pam(distance_matrix)
+    return clusters
+
+
+# This function computes the Euclidean distances between two sets of data points
+# param x: A matrix of data points
+# param y: A matrix of data points
+# return: A matrix of the distance between each point of x and each point of y
+def get_point_distances(x, y):
+    distances = np.einsum('ij,ij->i', x, x)[:, None] - 2 * (x @ y.T) + np.einsum('ij,ij->i', y, y)
+    return np.sqrt(np.maximum(distances, 0))
+
+
+# This function assigns every data point to its nearest medoid, computing distances to the medoids only
+# param data: A matrix of data points
+# param medoid_indices: An array of medoids
+# return: An array of the index of the nearest medoid of each data point and an array of the distance to it
+def assign_to_medoids(data, medoid_indices):
+    distances = get_point_distances(data, data[medoid_indices])
+    nearest = np.argmin(distances, axis=1)
+    return nearest, distances[np.arange(len(data)), nearest]
+
+
+# This function groups the data points by the index of their nearest medoid
+# param nearest: An array of the index of the nearest medoid of each data point
+# return: An array of clusters
+def get_medoid_clusters(nearest):
+    clusters = [[] for _ in range(k)]
+    for i in range(len(nearest)):
+        clusters[nearest[i]].append(i)
+    return clusters
+
+
+# This function implements CLARA which runs PAM on random samples of the data points and keeps the medoids
+# with the smallest total distance over all data points, so only the distances within a sample and from every data
+# point to the medoids are computed
+# param data: An array of data points
+# param samples: The number of samples
+# param sample_size: The number of data points in each sample
+# param seed: The seed of the random samples
+# return: An array of indices of the medoids and an array of output clusters
+def extract_clara_clusters(data, samples=CLARA_SAMPLES, sample_size=CLARA_SAMPLE_SIZE, seed=None):
+    data = np.asarray(data, dtype=np.float64)
+    rng = np.random.default_rng(seed)
+    best_cost = float("inf")
+
+    for _ in range(samples):
+        sample = np.sort(rng.choice(len(data), min(sample_size, len(data)), replace=False))
+        sample_distances = np.round(get_point_distances(data[sample], data[sample]), 4)
+        sample_medoids, sample_clusters = run_pam(sample_distances)
+        medoid_indices = sample[sample_medoids]
+
+        nearest, distances = assign_to_medoids(data, medoid_indices)
+        if distances.sum() < best_cost:
+            best_cost = distances.sum()
+            best_medoids = medoid_indices
+            best_nearest = nearest
+
+    return list(best_medoids), get_medoid_clusters(best_nearest)
+
+
+# This function implements CLARANS, a randomized search over medoid swaps. Each local search starts from random
+# medoids and moves to a random neighbor, the medoids with one medoid swapped for another data point, whenever that
+# lowers the total distance, stopping after max_neighbors neighbors in a row fail to. The distance to the nearest
+# and second nearest medoid of every data point is kept so that a swap is evaluated in one pass
+# param data: An array of data points
+# param local_searches: The number of local searches
+# param max_neighbors: The number of failed neighbors after which a local search stops (None for the default)
+# param seed: The seed of the random search
+# return: An array of indices of the medoids and an array of output clusters
+def extract_clarans_clusters(data, local_searches=CLARANS_LOCAL_SEARCHES, max_neighbors=CLARANS_MAX_NEIGHBORS,
+                             seed=None):
+    data = np.asarray(data, dtype=np.float64)
+    rng = np.random.default_rng(seed)
+    if max_neighbors is None:
+        max_neighbors = max(250, int(0.0125 * k * (len(data) - k)))
+    best_cost = float("inf")
+    rows = np.arange(len(data))
+
+    for _ in range(local_searches):
+        medoid_indices = rng.choice(len(data), k, replace=False)
+        distances = get_point_distances(data, data[medoid_indices])
+        failures = 0
+        swapped = True
+
+        while failures < max_neighbors:
+            # The nearest and second nearest medoids only change when a swap is accepted
+            if swapped:
+                order = np.argsort(distances, axis=1)
+                nearest = order[:, 0]
+                nearest_distance = distances[rows, nearest]
+                second_distance = distances[rows, order[:, 1]] if k > 1 else np.full(len(data), np.inf)
+                current_cost = nearest_distance.sum()
+                swapped = False
+
+            # Picks a random medoid to swap out and a random non-medoid to swap in
+            removed = rng.integers(k)
+            added = rng.integers(len(data))
+            while added in medoid_indices:
+                added = rng.integers(len(data))
+            added_distance = get_point_distances(data, data[[added]]).ravel()
+
+            new_distance = np.where(nearest == removed, np.minimum(second_distance, added_distance),
+                                    np.minimum(nearest_distance, added_distance))
+            if new_distance.sum() < current_cost:
+                medoid_indices[removed] = added
+                distances[:, removed] = added_distance
+                swapped = True
+                failures = 0
+            else:
+                failures += 1
+
+        cost = distances.min(axis=1).sum()
+        if cost < best_cost:
+            best_cost = cost
+            best_medoids = medoid_indices.copy()
+            best_nearest = np.argmin(distances, axis=1)
+
+    return list(best_medoids), get_medoid_clusters(best_nearest)
 
 
 # This function writes the output clusters to a file, each cluster per line, following the format such as
@@ -156,7 +397,18 @@ def main():
     input_filename = 'assignment2_input.txt'
     output_filename = 'result1.txt'
     genes = get_input_data(input_filename)
-    gene_clusters = extract_kmedoid_clusters(genes)
+    if MEDOID_MODE == 'clara':
+        medoids, gene_clusters = extract_clara_clusters(genes)
+    elif MEDOID_MODE == 'clarans':
+        medoids, gene_clusters = extract_clarans_clusters(genes)
+    elif MEDOID_MODE == 'pam':
+        gene_clusters = extract_pam_clusters(genes)
+    else:
+        report = []
+        gene_clusters = extract_kmedoid_clusters(genes, report)
+        for i in range(len(report)):
+            print("iteration " + str(i + 1) + ": moved " + str(report[i][1]) + " points in " +
+                  format(report[i][0], '.4f') + " seconds")
     output_to_file(output_filename,gene_clusters,genes)
 
 